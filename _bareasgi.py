@@ -1,10 +1,18 @@
+import json
+
 import bareasgi as _bareasgi
 from bareasgi import *
 
-def json_response(data, status=200, headers={}):
-  headers = [] # FIXME
-  return _bareasgi.json_response(status, headers, data)
+def json_response(data, status=200, headers=None):
+  return _bareasgi.json_response(status, list(headers or []), data)
+
+def text_response(text, status=200, headers=None):
+  return _bareasgi.text_response(status, list(headers or []), text)
+
+async def _ndjson(items):
+  async for e in items:
+    yield (json.dumps(e) + '\n').encode()
 
-def text_response(text, status=200, headers={}):
-  headers = []
-  return _bareasgi.text_response(status, headers, text)
+def ndjson_response(items, status=200, headers=None):
+  headers = [(b'content-type', b'application/x-ndjson'), *(headers or [])]
+  return status, headers, _ndjson(items)
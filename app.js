@@ -5,7 +5,6 @@
 /* eqeqeq: false */
 /* -W041: false */
 const type = require('type-of');
-const request = require('superagent');
 const h = require('hyperscript-string');
 const $ = require('domtastic');
 const rivets = require('rivets');
@@ -33,16 +32,85 @@ function _error(method, url, { response: res }) {
   console.warn(`[${method} ${url}]`, ...res);
 }
 
+function read_lines(res, cb) {
+  // Calls `cb` with each line of the newline-delimited JSON response `res`, as it arrives
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  const read = () => reader.read().then(({ done, value }) => {
+    buffer += decoder.decode(value, { stream: !done });
+    let lines = buffer.split('\n');
+    buffer = lines.pop();
+    lines.filter((e) => e != '').forEach((e) => cb(JSON.parse(e)));
+    if (!done)
+      return read();
+  });
+  return read();
+}
+
+const channel = { socket: null, id: 0, pending: {} };
+
+function open_channel() {
+  // Conversation WebSocket; while it is open, messages are sent over it instead of POST /message
+  const scheme = location.protocol == 'https:' ? 'wss' : 'ws';
+  const socket = new WebSocket(`${scheme}://${location.host}/conversation`);
+  socket.onopen = () => {
+    channel.socket = socket;
+  };
+  socket.onmessage = ({ data }) => {
+    data = JSON.parse(data);
+    let entry = channel.pending[data.id];
+    if (!entry)
+      return;
+    if (!entry.shown && (data.line !== undefined || data.status == 200)) {
+      state.conversation.push(entry.message);
+      entry.shown = true;
+    }
+    if (data.line !== undefined) {
+      entry.message.text.push(data.line);
+      return;
+    }
+    delete channel.pending[data.id];
+    if (data.status != 200) {
+      _error('WS', '/conversation', { response: { status: data.status } });
+      entry.cb && entry.cb();
+    }
+  };
+  socket.onclose = () => {
+    channel.socket = null;
+    Object.values(channel.pending).forEach(({ cb }) => cb && cb());
+    channel.pending = {};
+    setTimeout(open_channel, 5000);
+  };
+}
+
 function send_message(text='', cb) {
-  request.post('/message').send(text).then(({ body }) => {
-    state.conversation.push({ text: body });
-  }, (e) => { 
+  let message = { text: [] };
+  if (channel.socket) {
+    let id = ++channel.id;
+    channel.pending[id] = { message, cb };
+    channel.socket.send(JSON.stringify({ id, text }));
+    return Promise.resolve();
+  }
+  return fetch('/message', {
+    method: 'POST',
+    body: text,
+    credentials: 'same-origin',
+    headers: { 'Accept': 'application/x-ndjson', 'Content-Type': 'text/plain' }
+  }).then((res) => {
+    if (!res.ok)
+      return res.text().then((text) => Promise.reject({ response: { status: res.status, text } }));
+    state.conversation.push(message);
+    return read_lines(res, (line) => {
+      message.text.push(line);
+    });
+  }).catch((e) => { 
     _error('POST', '/message', e);
     cb && cb();
   });
 }
 
-send_message();
+send_message().then(open_channel);
 
 $('.Conversation-input')
   .on('keydown', (e) => {
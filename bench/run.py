@@ -0,0 +1,146 @@
+"""Offline load test of the app against local stand-ins for its upstream services"""
+import argparse, asyncio, json, os, random, sys, tempfile
+from collections import defaultdict
+from time import monotonic
+
+import yaml
+
+from bench.upstreams import Fault, Watson, Wikipedia, Weather, ChuckNorris
+from util.cache import Journal
+
+here = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MIX = {   # kind -> (weight, utterances)
+  'welcome': (0.05, ['']),
+  'open-ended': (0.5, ['what is a quasar', 'who was Ada Lovelace', 'tell me about volcanoes',
+                       'what is the speed of light', 'how do bees make honey', 'what is entropy']),
+  'weather': (0.25, ['weather in Paris', 'temperature in London', 'what is the weather in Tokyo',
+                     'wind in Berlin']),
+  'jokes': (0.2, ['tell me a joke', 'chuck norris jokes', 'another joke please']),
+}
+
+def replay(path):
+  return [value['question'] for key, value in Journal(path).load()]
+
+def _config(watson, weather, auth):
+  service = dict(version='2019-02-28', url=watson.url, **auth)
+  return {
+    'ibm_cloud': {
+      'chatbot': dict(id='chatbot', **service),
+      'wikibot': dict(id='wikibot', **service),
+      'weather': { 'host': 'bench', 'username': 'bench', 'password': 'bench' },
+    },
+  }
+
+class Lifespan:
+  def __init__(self, app):
+    self._queue = asyncio.Queue()
+    self._done = asyncio.Queue()
+    self._task = asyncio.ensure_future(app({ 'type': 'lifespan' })(self._queue.get, self._done.put))
+
+  async def send(self, type):
+    await self._queue.put({ 'type': type })
+    await self._done.get()
+
+async def post(app, path, body, headers):
+  scope = {
+    'type': 'http', 'http_version': '1.1', 'method': 'POST', 'scheme': 'http',
+    'path': path, 'raw_path': path.encode(), 'query_string': b'', 'root_path': '',
+    'headers': [(b'content-type', b'text/plain'), *headers],
+    'server': ('bench', 80), 'client': ('127.0.0.1', 0),
+  }
+  requests = [{ 'type': 'http.request', 'body': body, 'more_body': False }]
+  async def receive():
+    if requests:
+      return requests.pop()
+    await asyncio.Event().wait()
+  status, chunks = None, []
+  async def send(message):
+    nonlocal status
+    if message['type'] == 'http.response.start':
+      status = message['status']
+    else:
+      chunks.append(message.get('body', b''))
+  await app(scope)(receive, send)
+  return status, b''.join(chunks)
+
+def _pick():
+  kinds = list(MIX)
+  kind = random.choices(kinds, [MIX[e][0] for e in kinds])[0]
+  return kind, random.choice(MIX[kind][1])
+
+async def conversation(app, turns, samples, think):
+  headers = [(b'x-session-id', os.urandom(8).hex().encode())]
+  for i in range(turns):
+    kind, text = _pick()
+    start = monotonic()
+    try:
+      status, body = await post(app, '/message', text.encode(), headers)
+    except Exception as e:
+      status = repr(e)
+    samples[kind].append((monotonic() - start, status == 200))
+    if think:
+      await asyncio.sleep(random.uniform(0, think))
+
+def percentile(data, p):
+  data = sorted(data)
+  if not data:
+    return float('nan')
+  return data[min(int(len(data) * p), len(data) - 1)]
+
+def report(samples, elapsed, out=sys.stdout):
+  total = sum(len(e) for e in samples.values())
+  print(f"{total} messages in {elapsed:.2f}s: {total / elapsed:.1f} msg/s", file=out)
+  print(f"{'intent':<12} {'count':>6} {'errors':>6} {'p50 ms':>8} {'p99 ms':>8}", file=out)
+  for kind, data in sorted(samples.items()):
+    latency = [e[0] * 1e3 for e in data]
+    errors = sum(1 for e in data if not e[1])
+    print(f"{kind:<12} {len(data):>6} {errors:>6} {percentile(latency, .5):>8.1f} {percentile(latency, .99):>8.1f}", file=out)
+
+async def main(args):
+  if args.replay:
+    MIX['open-ended'] = (MIX['open-ended'][0], replay(args.replay) or MIX['open-ended'][1])
+  fault = lambda: Fault(args.latency, args.jitter, args.errors)
+  upstreams = [await e(fault()).start() for e in (Watson, Wikipedia, Weather, ChuckNorris)]
+  watson, wikipedia, weather, chuck_norris = upstreams
+
+  config = tempfile.NamedTemporaryFile('w', suffix='.yaml', delete=False)
+  with config:
+    yaml.safe_dump(_config(watson, weather, json.loads(args.watson_auth)), config)
+  os.environ.update({
+    'WHIZBOT_CONFIG': config.name,
+    'WHIZBOT_WIKIPEDIA_URL': f"{wikipedia.url}/w/api.php",
+    'WHIZBOT_WEATHER_URL': f"{weather.url}/api/weather",
+    'WHIZBOT_CHUCK_NORRIS_URL': f"{chuck_norris.url}/jokes",
+  })
+  sys.path.insert(0, here)
+  from main import app
+
+  lifespan = Lifespan(app)
+  await lifespan.send('lifespan.startup')
+  samples = defaultdict(list)
+  start = monotonic()
+  await asyncio.gather(*(conversation(app, args.turns, samples, args.think) for i in range(args.conversations)))
+  report(samples, monotonic() - start)
+  await lifespan.send('lifespan.shutdown')
+
+  print('upstream calls:', ', '.join(f"{type(e).__name__}={e.calls}" for e in upstreams))
+  for e in upstreams:
+    e.close()
+  os.unlink(config.name)
+
+def parse(argv=None):
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('--conversations', type=int, default=20, help='concurrent conversations')
+  parser.add_argument('--turns', type=int, default=10, help='messages per conversation')
+  parser.add_argument('--think', type=float, default=0.0, help='max pause between turns (seconds)')
+  parser.add_argument('--latency', type=float, default=0.05, help='upstream latency (seconds)')
+  parser.add_argument('--jitter', type=float, default=0.02, help='upstream latency jitter (seconds)')
+  parser.add_argument('--errors', type=float, default=0.0, help='upstream error rate (0..1)')
+  parser.add_argument('--replay', metavar='FILE', help='ask the questions of this answers journal as open-ended ones')
+  parser.add_argument('--watson-auth', default='{"username": "bench", "password": "bench"}',
+                      help='JSON of Watson constructor credentials')
+  return parser.parse_args(argv)
+
+if __name__ == '__main__':
+  asyncio.get_event_loop().run_until_complete(main(parse()))
@@ -0,0 +1,207 @@
+"""Local stand-ins for the services Whizbot calls"""
+import asyncio, json, random, re
+from urllib.parse import urlsplit, parse_qs
+from uuid import uuid4
+
+
+class Fault:
+  def __init__(self, latency=0.0, jitter=0.0, errors=0.0):
+    self.latency = latency
+    self.jitter = jitter
+    self.errors = errors
+
+  async def __call__(self):
+    """Returns True if this response should fail"""
+    delay = self.latency + random.uniform(-self.jitter, self.jitter)
+    if delay > 0:
+      await asyncio.sleep(delay)
+    return random.random() < self.errors
+
+def route(method, pattern):
+  def deco(func):
+    func.route = (method, re.compile(f"^{pattern}$"))
+    return func
+  return deco
+
+class Upstream:
+  """Minimal HTTP/1.1 server dispatching to its `route` methods"""
+  def __init__(self, fault=None):
+    self.fault = fault or Fault()
+    self.calls = 0
+    self.url = None
+    self._server = None
+    self._routes = [e.route + (e,) for e in (getattr(self, k) for k in dir(type(self))) if hasattr(e, 'route')]
+
+  async def start(self, host='127.0.0.1', port=0):
+    self._server = await asyncio.start_server(self._serve, host, port)
+    port = self._server.sockets[0].getsockname()[1]
+    self.url = f"http://{host}:{port}"
+    return self
+
+  def close(self):
+    if self._server:
+      self._server.close()
+
+  def _dispatch(self, method, path, query, body):
+    for _method, pattern, handler in self._routes:
+      match = pattern.match(path)
+      if match and _method == method:
+        return handler(match, query, body)
+    return 404, { 'error': f"no route for {method} {path}" }
+
+  async def _serve(self, reader, writer):
+    try:
+      while True:
+        line = await reader.readline()
+        if not line:
+          break
+        method, target, version = line.decode('latin-1').split()
+        length = 0
+        while True:
+          header = await reader.readline()
+          if header in (b'\r\n', b'\n', b''):
+            break
+          name, _, value = header.decode('latin-1').partition(':')
+          if name.strip().lower() == 'content-length':
+            length = int(value)
+        raw = await reader.readexactly(length) if length else b''
+        self.calls += 1
+
+        url = urlsplit(target)
+        query = { k: v[-1] for k, v in parse_qs(url.query).items() }
+        if await self.fault():
+          status, body = 500, { 'error': 'injected failure' }
+        else:
+          status, body = self._dispatch(method, url.path, query, json.loads(raw) if raw else None)
+        data = json.dumps(body).encode()
+        writer.write(f"HTTP/1.1 {status} X\r\nContent-Type: application/json\r\n"
+                     f"Content-Length: {len(data)}\r\nConnection: keep-alive\r\n\r\n".encode() + data)
+        await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+      pass
+    finally:
+      writer.close()
+
+_words = re.compile(r"\w+")
+
+class Watson(Upstream):
+  def __init__(self, fault=None):
+    super().__init__(fault)
+    self.intents = {}   # workspace -> [intent]
+    self.nodes = {}     # workspace -> [dialog node]
+
+  @staticmethod
+  def _classify(text):
+    words = set(_words.findall(text.casefold()))
+    if words & { 'weather', 'temperature', 'wind' }:
+      notions = [e for e in ('weather', 'temperature') if e in words]
+      cities = [e for e in ('paris', 'london', 'berlin', 'tokyo') if e in words]
+      entities = [{ 'entity': 'notion', 'value': e } for e in notions + [e.title() for e in cities]]
+      return 'weather', 0.97, entities, 'Which city?'
+    if words & { 'joke', 'jokes', 'chuck' }:
+      entities = [{ 'entity': 'notion', 'value': 'joke' }] if 'joke' in words else []
+      return 'chuck_norris', 0.95, entities, ''
+    if words & { 'hello', 'who', 'you' } and 'you' in words:
+      return 'identity', 0.93, [], "I'm Whizbot."
+    return None, 0.0, [], ''
+
+  @route('POST', r'/v2/assistants/([^/]+)/sessions')
+  def create_session(self, match, query, body):
+    return 201, { 'session_id': uuid4().hex }
+
+  @route('POST', r'/v2/assistants/([^/]+)/sessions/([^/]+)/message')
+  def message_v2(self, match, query, body):
+    input = (body or {}).get('input') or {}
+    intents = input.get('intents') or []
+    if intents:
+      intent, confidence, entities, text = intents[0]['intent'], 1.0, [], f"({intents[0]['intent']})"
+    else:
+      intent, confidence, entities, text = self._classify(input.get('text') or '')
+    output = {
+      'generic': [{ 'response_type': 'text', 'text': text }],
+      'intents': [{ 'intent': intent, 'confidence': confidence }] if intent else [],
+      'entities': entities,
+    }
+    return 200, { 'output': output, 'context': (body or {}).get('context') or {} }
+
+  @route('POST', r'/v1/workspaces/([^/]+)/message')
+  def message_v1(self, match, query, body):
+    text = ((body or {}).get('input') or {}).get('text') or ''
+    answers = { n['conditions'].lstrip('#'): n for n in self.nodes.get(match[1], []) }
+    for intent in self.intents.get(match[1], []):
+      if any(e['text'] == text for e in intent['examples']) and intent['intent'] in answers:
+        node = answers[intent['intent']]
+        value = node['output']['generic'][0]['values'][0]['text']
+        return 200, { 'output': { 'text': [value] }, 'intents': [{ 'intent': intent['intent'], 'confidence': 1.0 }],
+                      'entities': [], 'context': {} }
+    return 200, { 'output': { 'text': [] }, 'intents': [], 'entities': [], 'context': {} }
+
+  @route('POST', r'/v1/workspaces/([^/]+)/intents')
+  def create_intent(self, match, query, body):
+    intents = self.intents.setdefault(match[1], [])
+    if any(e['intent'] == body['intent'] for e in intents):
+      return 409, { 'error': f"Unique Violation: The value \"{body['intent']}\" already exists" }
+    intents.append(body)
+    return 201, body
+
+  @route('POST', r'/v1/workspaces/([^/]+)/dialog_nodes')
+  def create_dialog_node(self, match, query, body):
+    nodes = self.nodes.setdefault(match[1], [])
+    if any(e['dialog_node'] == body['dialog_node'] for e in nodes):
+      return 409, { 'error': f"Unique Violation: The value \"{body['dialog_node']}\" already exists" }
+    nodes.append(body)
+    return 201, body
+
+  @route('GET', r'/v1/workspaces/([^/]+)/intents')
+  def list_intents(self, match, query, body):
+    return 200, { 'intents': self.intents.get(match[1], []) }
+
+  @route('GET', r'/v1/workspaces/([^/]+)/dialog_nodes')
+  def list_dialog_nodes(self, match, query, body):
+    return 200, { 'dialog_nodes': self.nodes.get(match[1], []) }
+
+class Wikipedia(Upstream):
+  @route('GET', r'/w/api.php')
+  def search(self, match, query, body):
+    words = _words.findall(query.get('srsearch', ''))
+    if not words:
+      return 200, { 'query': { 'search': [] } }
+    limit = int(query.get('srlimit', 10))
+    topic = words[-1]
+    results = [{
+      'title': topic.title(),
+      'snippet': f'<span class="searchmatch">{topic}</span> is a topic &amp; this is result {i} about it.',
+    } for i in range(limit)]
+    return 200, { 'query': { 'search': results } }
+
+class Weather(Upstream):
+  @route('GET', r'/api/weather/v3/location/search')
+  def location(self, match, query, body):
+    seed = sum(map(ord, query.get('query', '')))
+    return 200, { 'location': { 'latitude': [round(seed % 180 - 90, 2)], 'longitude': [round(seed % 360 - 180, 2)] } }
+
+  @route('GET', r'/api/weather/v1/geocode/([^/]+)/([^/]+)/observations.json')
+  def observations(self, match, query, body):
+    return 200, {
+      'metadata': { 'units': query.get('units', 'm') },
+      'observation': {
+        'wx_phrase': 'Partly Cloudy', 'temp': 21, 'feels_like': 20, 'min_temp': 15, 'max_temp': 24,
+        'wspd': 12, 'wdir_cardinal': 'NW', 'precip_total': 0, 'precip_hrly': 0, 'snow_hrly': 0,
+        'pressure': 1013, 'vis': 10,
+      },
+    }
+
+class ChuckNorris(Upstream):
+  categories = ['dev', 'movie', 'food', 'science']
+
+  @route('GET', r'/jokes/categories')
+  def list_categories(self, match, query, body):
+    return 200, self.categories
+
+  @route('GET', r'/jokes/random')
+  def random(self, match, query, body):
+    category = query.get('category')
+    if category and category not in self.categories:
+      return 404, { 'error': 'no such category' }
+    id = uuid4().hex
+    return 200, { 'id': id, 'value': f"Chuck Norris joke #{id[:6]}", 'categories': [category] if category else [] }
@@ -1,55 +1,151 @@
-import os, re
+import os, re, json, asyncio
 from itertools import chain, zip_longest
-from collections import namedtuple
+from collections import namedtuple, defaultdict, deque
 
 from munch import munchify
 import yaml
 
-from util import realpath, Object, Executor, HTMLParser
+from util import realpath, Object, Executor, Timer, Text, normalize
+from util.text import sentence
+from util.markup import strip_html, strip_all
+from util.cache import Cache, Journal
+from util.aio import SingleFlight
+from util.deadline import detach, spend
+from util.breaker import CircuitBreaker, CircuitOpen, server_error
+from util import request
 from util.request import Request
+from util.view import view, unwrap
+from util.store import connect
 
 
-with open(realpath('config.yaml')) as f:
+with open(realpath(os.getenv('WHIZBOT_CONFIG', 'config.yaml'))) as f:
   data = yaml.load(f, Loader=yaml.SafeLoader)
   locals().update(munchify(data))
   
+def setting(name, default=None):
+  """WHIZBOT_<NAME> from the environment, else `name` in config.yaml's settings"""
+  value = os.getenv(f"WHIZBOT_{name.upper()}")
+  if value is None:
+    return (data.get('settings') or {}).get(name, default)
+  if isinstance(default, bool):
+    return value.lower() in ('1', 'true', 'yes', 'on')
+  if isinstance(default, (int, float)):
+    return type(default)(value)
+  return value
+  
+Executor.configure(max_workers=setting('workers', 32), limit=setting('concurrency', 64),
+                   timeout=setting('task_timeout', 30.0))
+request.configure(pool_size=setting('http_pool', 32), hosts=setting('http_hosts', {}),
+                  retries=setting('http_retries', 0), http2=setting('http2', False),
+                  keepalive=setting('http_keepalive', 5.0), timeout=setting('http_timeout', 10.0))
+CircuitBreaker.configure(threshold=setting('breaker_threshold', 0.5), window=setting('breaker_window', 20),
+                         minimum=setting('breaker_minimum', 5), cooldown=setting('breaker_cooldown', 30.0))
+cache_store = connect(setting('cache_store'))   # shared by worker processes, see util.store
+  
 class chuck_norris:
-  _base = 'https://api.chucknorris.io/jokes'
+  _base = setting('chuck_norris_url', 'https://api.chucknorris.io/jokes')
   _categories = Request('GET', f'{_base}/categories')
   _random = Request('GET', f'{_base}/random')
+  _category_list = None
+  _category_timer = Timer(mins=setting('joke_categories_ttl', 60))
+  _pool = defaultdict(deque)
+  _pool_size = setting('joke_pool', 10)
+  _tasks = {}
+  _breaker = CircuitBreaker('jokes', failed=lambda res: not res)
+  
+  @classmethod
+  def _background(cls, key, func, *args):
+    task = cls._tasks.get(key)
+    if task is None or task.done():
+      cls._tasks[key] = detach(func(*args))
   
   @classmethod
-  def categories(cls, raw=False):
-    ret = cls._categories().json()
+  async def _fetch_categories(cls):
+    cls._category_timer()   # restarted on every attempt: a stale check resets it, so a failed refresh must re-arm it
+    try:
+      with spend('jokes') as call:
+        res = call.check(await cls._breaker(cls._categories.fetch))
+    except (CircuitOpen, asyncio.TimeoutError):
+      return cls._category_list
+    if res.ok:
+      cls._category_list = res.json()
+    return cls._category_list
+  
+  @classmethod
+  async def categories(cls, raw=False):
+    ret = cls._category_list
+    if ret is None:
+      ret = await cls._fetch_categories() or []
+    elif cls._category_timer:   # stale
+      cls._background('categories', cls._fetch_categories)
     if raw:
       return ret
     return ', '.join(ret)
   
   @classmethod
-  def random(cls, category=None, count=1, raw=False):
+  async def _fetch(cls, category, count):
     params = None
     if category:
       params = { 'category': category }
       
-    executor = Executor()
-    for i in executor(count):
-      executor[cls._random](params=params)
-      
-    ret = [munchify(e.json()) for e in executor.collect()]
-    if raw:
-      return ret
-    return [e.value for e in ret]
+    try:
+      with spend('jokes') as call:
+        ret = await cls._breaker(cls._gather, params, count)
+        if not ret:   # every fetch failed
+          call.fail()
+        return ret
+    except CircuitOpen:
+      return []
+  
+  @classmethod
+  async def _gather(cls, params, count):
+    res = await Executor.shared().map(cls._random, [params] * count, return_exceptions=True)
+    return [view(e.json()) for e in res if not isinstance(e, BaseException) and e.ok]
+  
+  @classmethod
+  async def _refill(cls, category):
+    pool = cls._pool[category]
+    missing = cls._pool_size - len(pool)
+    if missing <= 0:
+      return
+    known = { e.id for e in pool }
+    for joke in await cls._fetch(category, missing):
+      if joke.id not in known:
+        known.add(joke.id)
+        pool.append(joke)
+  
+  @classmethod
+  def buffered(cls):
+    return { category: len(pool) for category, pool in cls._pool.items() }
+  
+  @classmethod
+  def warm(cls):
+    cls._background('categories', cls._fetch_categories)
+    cls._background(('jokes', None), cls._refill, None)
+  
+  @classmethod
+  async def stream(cls, category=None, count=1):
+    """Yields buffered jokes first, then fetched ones as they arrive"""
+    pool = cls._pool[category]
+    while pool and count:
+      count -= 1
+      yield pool.popleft().value
+    tasks = [asyncio.ensure_future(cls._fetch(category, 1)) for i in range(count)]
+    try:
+      for task in asyncio.as_completed(tasks):
+        for joke in await task:
+          yield joke.value
+    finally:
+      for task in tasks:
+        task.cancel()
+      cls._background(('jokes', category), cls._refill, category)
   
-_parser = HTMLParser()
-def strip_html(html):
-  return _parser(html).text
-    
 class Snippet:
-  def __init__(self, data):
+  def __init__(self, data, text=None):
     self._data = data
-    self._text = strip_html(data.snippet).strip()
-    if not re.match(r'^.*[\.!\?]$', self._text):
-      self._text = f"{self._text}…"
+    if text is None:
+      text = strip_html(data.snippet)
+    self._text = Text(sentence(text))
     self._caption = data.title
     
   def __bool__(self):
@@ -64,7 +160,7 @@ class Snippet:
     return self._caption
   
 class wikipedia:
-  _base = 'https://en.wikipedia.org/w/api.php'
+  _base = setting('wikipedia_url', 'https://en.wikipedia.org/w/api.php')
   _search = Request('GET', _base, params={
     'action': 'query',
     'format': 'json',
@@ -72,24 +168,44 @@ class wikipedia:
     'srsort': 'relevance',
     'srenablerewrites': 'on'
   })
+  _cache = Cache(setting('wikipedia_cache', 1024), setting('wikipedia_ttl', 3600),
+                 maxbytes=setting('wikipedia_cache_bytes', 4 << 20), name='wikipedia', store=cache_store,
+                 encode=lambda e: json.dumps(unwrap(e)), decode=lambda e: view(json.loads(e)))
+  _breaker = CircuitBreaker('wikipedia', server_error)
   def __new__(cls, query, type=None, count=None):
+    return cls._query(query, type, count)
+  
+  @classmethod
+  async def _query(cls, query, type, count):
+    key = (normalize(query), type, count)
+    ret = await cls._cache.fetch(key)
+    if ret is not None:
+      return ret
+    
     params = { 'srsearch': query }
     if count is not None:
       params['srlimit'] = count
     if type is not None:
       params['srprop'] = type
-    res = cls._search(params=params)
+    try:
+      with spend('wikipedia') as call:
+        res = call.check(await cls._breaker(cls._search.fetch, params=params))
+    except CircuitOpen:
+      return cls._cache.peek(key, [])
     if not res.ok:
-      return []
-    return munchify(res.json()).query.search
+      return cls._cache.peek(key, [])
+    ret = view(res.json()).query.search
+    cls._cache.set(key, ret, len(res.content))
+    return ret
     
   @classmethod
-  def snippets(cls, query, count=None):
-    return [Snippet(e) for e in cls(query, 'snippet', count)]
+  async def snippets(cls, query, count=None):
+    data = await cls(query, 'snippet', count)
+    return [Snippet(e, text) for e, text in zip(data, strip_all(e.snippet for e in data))]
   
   @classmethod
-  def snippet(cls, query):
-    ret = cls.snippets(query, 1)
+  async def snippet(cls, query):
+    ret = await cls.snippets(query, 1)
     return ret[0] if ret else None
   
 _units = Object(metric='m', imperial='e')
@@ -185,30 +301,74 @@ class Observation:
   def visibility(self):
     return self._data.vis
   
+class Location:
+  def __init__(self, latitude, longitude, request):
+    self.latitude = latitude
+    self.longitude = longitude
+    self._observations = request
+    
+  @property
+  def geocode(self):
+    return f"geocode/{self.latitude}/{self.longitude}"
+  
 class Weather:
   notions = { 'forecast', 'humidity', 'precipitation', 'pressure', 'temperature', 'visibility', 'weather', 'wind speed' }
   def __init__(self, host, username, password):
     self._host = host
     self._auth = (username, password)
-    self._url = f"https://{host}/api/weather"
+    self._url = setting('weather_url') or f"https://{host}/api/weather"
     self._language = 'en-US'
     self._params = dict(language=self._language)
     self._location = Request('GET', f"{self._url}/v3/location/search", params=self._params, auth=self._auth)
-    self._current = None
+    self._geocodes = Cache(setting('geocode_cache', 4096), name='geocode', store=cache_store,
+                           encode=lambda e: json.dumps([e.latitude, e.longitude]),
+                           decode=lambda e: self.geocode(*json.loads(e)))
+    self._observations = Cache(setting('observation_cache', 4096), setting('observation_ttl', 300), name='observations')
+    self._flights = SingleFlight()
+    self._breaker = CircuitBreaker('weather', server_error)
+    path = setting('geocode_file')
+    self._journal = Journal(path) if path else None
+    self._load_geocodes()
     
-  def __bool__(self):
-    return bool(self._current)
+  def _load_geocodes(self):
+    if not self._journal:
+      return
+    pairs = self._journal.load()
+    for query, value in pairs:
+      try:
+        latitude, longitude = value
+      except (TypeError, ValueError):   # malformed entry
+        continue
+      if isinstance(query, str):
+        self._geocodes.set(query, self.geocode(latitude, longitude), share=False)
+    if len(pairs) > len({ json.dumps(k) for k, v in pairs }):   # superseded entries
+      self._journal.compact()   # from the journal itself: the cache may hold fewer queries
+    
+  def geocode(self, latitude, longitude):
+    geocode = f"geocode/{latitude}/{longitude}"
+    request = Request('GET', f"{self._url}/v1/{geocode}/observations.json", params=self._params, auth=self._auth)
+    return Location(latitude, longitude, request)
     
-  def location(self, query):
-    res = self._location(params=dict(query=query))
+  async def location(self, query):
+    key = normalize(query)
+    ret = await self._geocodes.fetch(key)
+    if ret is not None:
+      return ret
+    
+    try:
+      with spend('geocode') as call:
+        res = call.check(await self._breaker(self._location.fetch, params=dict(query=query)))
+    except CircuitOpen:
+      return None
     if not res.ok:
-      return False
+      return None
     location = res.result().location
     latitude = location.latitude[0]
     longitude = location.longitude[0]
-    geocode = f"geocode/{latitude}/{longitude}"
-    self._current = Request('GET', f"{self._url}/v1/{geocode}/observations.json", params=self._params, auth=self._auth)
-    return True
+    ret = self._geocodes[key] = self.geocode(latitude, longitude)
+    if self._journal:
+      self._journal.put(key, [latitude, longitude])
+    return ret
   
   def forecast(self, hours=None, days=None):
     pass
@@ -217,11 +377,25 @@ class Weather:
     units = _units.get(units, units)
     return dict(units=units, **self._params)
     
-  def current(self, units='m'):
-    if not self:
+  async def current(self, location, units='m'):
+    if not location:
       return
-    res = self._current(params=self.get_params(units))
+    key = (location.geocode, units)
+    ret = self._observations.get(key)
+    if ret is None:
+      try:
+        ret = await self._flights(key, self._current, key, location, units)
+      except CircuitOpen:
+        ret = None
+      if ret is None:
+        ret = self._observations.peek(key)
+    return ret
+    
+  async def _current(self, key, location, units):
+    with spend('observations') as call:
+      res = call.check(await self._breaker(location._observations.fetch, params=self.get_params(units)))
     if res.ok:
-      return Observation(res.result())
+      ret = self._observations[key] = Observation(res.result())
+      return ret
     
-__all__ = { 'ibm_cloud', 'chuck_norris', 'wikipedia' }
+__all__ = { 'ibm_cloud', 'chuck_norris', 'wikipedia', 'setting', 'cache_store' }
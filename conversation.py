@@ -0,0 +1,97 @@
+import re, json
+from time import time
+from urllib.parse import parse_qs
+from uuid import uuid4
+
+from bareasgi import make_cookie
+from bareasgi.header import cookie, find
+
+from util.aio import run
+from util.cache import Cache
+from watson.assistant import State
+
+
+class Conversation:
+  """State of a single client's conversation"""
+  def __init__(self, id):
+    self.id = id
+    self.weather = None     # notions awaiting a location
+    self.location = None    # last `config.Location` asked about
+    self.watson = {}        # `watson.assistant.State` per assistant
+    self.saved = 0          # when last written to the shared store
+
+class Conversations(Cache):
+  """Conversations by session id, optionally shared through `store`"""
+  _cookie = 'whizbot'
+  _header = b'x-session-id'
+  _id = re.compile(r'^[\w-]{8,64}$')
+  
+  def __init__(self, maxsize, ttl, store=None, locate=None):
+    super().__init__(maxsize, ttl, refresh=True, name='conversations', store=store,
+                     encode=self._dump, decode=self._load)
+    self._locate = locate
+    
+  def _dump(self, conversation):
+    location = conversation.location
+    return json.dumps({ 'id': conversation.id, 'saved': conversation.saved,
+                        'weather': sorted(conversation.weather) if conversation.weather else None,
+                        'location': [location.latitude, location.longitude] if location else None,
+                        'watson': { k: v.dump() for k, v in conversation.watson.items() } })
+  
+  def _load(self, raw):
+    data = json.loads(raw)
+    ret = Conversation(data['id'])
+    ret.saved = data['saved']
+    ret.weather = set(data['weather']) if data['weather'] else None
+    if data['location'] and self._locate:
+      ret.location = self._locate(*data['location'])
+    ret.watson = { k: State.load(v) for k, v in data['watson'].items() }
+    return ret
+    
+  async def _get(self, id):
+    try:
+      ret = self._local(id)
+    except KeyError:
+      ret = None
+    raw = await run(self._store.get, self._shared_key(id)) if self._store else None
+    if raw is not None:
+      shared = self._decode(raw)
+      if ret is None or shared.saved > ret.saved:   # last handled by another process
+        self._put(id, shared, 0)
+        self.shared_hits += 1
+        return shared
+    if ret is None:
+      self.misses += 1
+    return ret
+    
+  def save(self, conversation):
+    if self.writes is not None and conversation.id:
+      conversation.saved = time()
+      self.writes.put(self._shared_key(conversation.id), self._encode(conversation))
+    
+  def _session_id(self, scope):
+    headers = scope['headers']
+    id = find(self._header, headers) or cookie(headers).get(self._cookie.encode())
+    if not id and scope.get('query_string'):
+      id = (parse_qs(scope['query_string']).get(b'session') or [None])[0]
+    if id:
+      id = id.decode('ascii', 'ignore')
+      if self._id.match(id):
+        return id
+    
+  async def __call__(self, scope):
+    """Returns the client's conversation and any headers binding it"""
+    id = self._session_id(scope)
+    if id:
+      ret = await self._get(id)
+      if ret is None:
+        ret = Conversation(id)
+        self.set(id, ret, share=False)    # shared once `save`d
+      return ret, []
+    
+    ret = Conversation(uuid4().hex)
+    self.set(ret.id, ret, share=False)
+    # a session cookie: the server's TTL slides with every message, so a fixed max-age would
+    # drop a conversation the server still holds; an expired id simply starts afresh
+    value = make_cookie(self._cookie, ret.id, httponly=True)
+    return ret, [(b'set-cookie', value)]
@@ -1,55 +1,321 @@
-import re
+import re, json, asyncio, logging
 
-from _bareasgi import text_reader, text_response, json_response
-from config import ibm_cloud, chuck_norris, wikipedia, Weather
+from _bareasgi import text_reader, text_response, json_response, ndjson_response
+from bareasgi.header import find
+from config import ibm_cloud, chuck_norris, wikipedia, Weather, setting, cache_store
+from conversation import Conversation, Conversations
 from watson import Assistant
-from util import split
+from util import Text, cache, breaker, request
+from util.metrics import counter, gauge, render
+from util.deadline import Deadline, detach
+from util.breaker import CircuitOpen
+from util.cache import Journal
+from watson import assistant as _watson
 
 
-def _clean(text):
-  """Strips any CR/LF/TAB characters from text"""
-  if text is None:
-    return None
-  return re.sub(r"\s+", " ", text)
-
 weather = Weather(**ibm_cloud.weather)
+conversations = Conversations(setting('conversations', 10000), setting('conversation_ttl', 3600),
+                              store=cache_store, locate=weather.geocode)
   
-assistant = Assistant(**ibm_cloud.chatbot)
-wikibot = Assistant.v1(**ibm_cloud.wikibot)
+_timeout = setting('watson_timeout', 10.0)
+assistant = Assistant(sessions=setting('watson_sessions', 8), timeout=_timeout, **ibm_cloud.chatbot)
+_answers_file = setting('answers_file')
+wikibot = Assistant.v1(backlog=setting('learn_backlog', 1000), store=cache_store, timeout=_timeout,
+                       journal=Journal(_answers_file) if _answers_file else None, **ibm_cloud.wikibot)
+
+_logger = logging.getLogger(__name__)
+
+_budget = setting('budget', 8.0)
+_retry_budget = setting('retry_budget', 2.0)
+_retry = None   # last `retry` answer, for when even that cannot be fetched in time
 assistant.link(wikibot, 0.9)
 
-def retry():
-  return json_response(assistant(intents=['retry']).text)
+_speculate = setting('speculate', 'question')   # off | question | always
+_speculation_limit = setting('speculate_limit', 32)
+_speculating = 0
+_question = re.compile(r"^(who|whom|whose|what|when|where|which|why|how|is|are|was|were|do|does|did|can)\b|\?$", re.I)
+
+def _speculated(task):
+  global _speculating
+  _speculating -= 1
+
+def speculate(text):
+  """Starts the Wikipedia lookup while the intent is being classified"""
+  global _speculating
+  if _speculate == 'off' or _speculating >= _speculation_limit:
+    return None
+  if _speculate == 'question' and not _question.search(text):
+    return None
+  _speculating += 1
+  task = asyncio.ensure_future(wikipedia.snippet(text))
+  task.add_done_callback(_speculated)
+  return task
+
+def _discard(task):
+  if task is not None:
+    task.cancel()
+
+async def startup(scope, info, request):
+  chuck_norris.warm()
+  assistant.sessions.start()
+  detach(_load_answers())
+
+async def _load_answers(backoff=1.0, limit=300.0):
+  while True:
+    try:
+      return await wikibot.load()
+    except Exception:
+      _logger.exception('Failed to load the wikibot answers, retrying in %gs', backoff)
+    await asyncio.sleep(backoff)
+    backoff = min(backoff * 2, limit)
+
+async def retry(conversation):
+  global _retry
+  try:
+    _retry = (await assistant(intents=['retry'], state=conversation.watson)).text
+  except (asyncio.TimeoutError, CircuitOpen):
+    if _retry is None:
+      raise
+  return _retry
+
+async def answer(conversation, text):
+  """`reply` within the budget, falling back to `retry`"""
+  try:
+    with Deadline(_budget):
+      return await reply(conversation, text)
+  except (asyncio.TimeoutError, CircuitOpen):
+    with Deadline(_retry_budget):
+      return await retry(conversation)
+
+_done = object()
+
+async def _produce(conversation, text, queue):
+  try:
+    sent = False
+    try:
+      with Deadline(_budget):
+        async for part in fragments(conversation, text):
+          sent = sent or bool(part)
+          for e in part:
+            queue.put_nowait(e)
+    except (asyncio.TimeoutError, CircuitOpen):
+      if not sent:
+        with Deadline(_retry_budget):
+          for e in await retry(conversation):
+            queue.put_nowait(e)
+    queue.put_nowait(_done)
+  except Exception as e:
+    queue.put_nowait(e)
+
+async def stream(conversation, text):
+  queue = asyncio.Queue()
+  task = asyncio.ensure_future(_produce(conversation, text, queue))
+  try:
+    while True:
+      e = await queue.get()
+      if e is _done:
+        return
+      if isinstance(e, Exception):
+        raise e
+      yield e
+  finally:
+    task.cancel()
+    conversations.save(conversation)
+
+async def _prepend(items, rest):
+  for e in items:
+    yield e
+  async for e in rest:
+    yield e
+
+async def _stream(conversation, text, headers):
+  lines = stream(conversation, text)
+  try:
+    first = [await lines.__anext__()]
+  except StopAsyncIteration:
+    first = []
+  except Unanswered:
+    return json_response([], 404, headers)
+  except (asyncio.TimeoutError, CircuitOpen):
+    return json_response([], 503, headers)
+  return ndjson_response(_prepend(first, lines), headers=headers)
+
+def _streaming(scope):
+  return b'application/x-ndjson' in (find(b'accept', scope['headers']) or b'')
 
-_weather = None
+def _input(raw):
+  return Text(raw.strip().lstrip('.'))
 
 async def message(scope, info, matches, content):
-  global _weather
-  text = _clean((await text_reader(content)).strip().lstrip('.').lstrip())
+  conversation, headers = await conversations(scope)
+  text = _input(await text_reader(content))
+  if _streaming(scope):
+    return await _stream(conversation, text, headers)
+  try:
+    ret = await answer(conversation, text)
+  except (asyncio.TimeoutError, CircuitOpen):   # not even `retry` could be answered
+    return json_response([], 503, headers)
+  finally:
+    conversations.save(conversation)
+  if ret is None:
+    return json_response([], 404, headers)
+  return json_response(ret, headers=headers)
+
+_batch_limit = setting('batch_limit', 1000)
+_batch_concurrency = setting('batch_concurrency', 8)
+
+async def _classify(texts, results):
+  watson = {}
+  for key, text in texts:
+    conversation = Conversation(None)
+    conversation.watson = watson
+    for state in watson.values():
+      state.context = None
+    try:
+      with Deadline(_budget):   # no `retry` fallback: a line out of time is reported as such
+        ret = await reply(conversation, text, learn=False)
+      status = 404 if ret is None else 200
+    except (asyncio.TimeoutError, CircuitOpen):
+      ret, status = None, 503
+    except Exception:   # one bad line must not stall the batch
+      ret, status = None, 500
+    await results.put((key, status, ret))
+
+async def _batch(lines, workers):
+  texts = {}    # key -> first text
+  indices = {}  # key -> (line number, text) of each line sharing it
+  for i, text in lines:
+    texts.setdefault(text.key, text)
+    indices.setdefault(text.key, []).append((i, text))
+    
+  results = asyncio.Queue()
+  pending = iter(texts.items())
+  tasks = [asyncio.ensure_future(_classify(pending, results)) for i in range(min(workers, len(texts)))]
+  try:
+    for n in range(len(texts)):
+      key, status, ret = await results.get()
+      for i, text in indices[key]:
+        yield { 'line': i, 'text': text, 'status': status, 'answer': ret or [] }
+  finally:
+    for task in tasks:
+      task.cancel()
+
+async def batch(scope, info, matches, content):
+  lines = [(i, _input(e)) for i, e in enumerate((await text_reader(content)).splitlines())]
+  lines = [(i, e) for i, e in lines if e]
+  if len(lines) > _batch_limit:
+    return json_response([], 413)
+  return ndjson_response(_batch(lines, _batch_concurrency))
+
+_ws_backlog = setting('ws_backlog', 16)
+
+def _frame(data):
+  if isinstance(data, bytes):
+    data = data.decode('utf-8', 'replace')
+  try:
+    data = json.loads(data)
+  except ValueError:
+    return None, _input(data)
+  if not isinstance(data, dict):
+    return None, _input(str(data))
+  return data.get('id'), _input(str(data.get('text') or ''))
+
+async def _converse(conversation, queue, web_socket):
+  while True:
+    id, text = await queue.get()
+    status = 200
+    try:
+      async for line in stream(conversation, text):
+        await web_socket.send(json.dumps({ 'id': id, 'line': line }))
+    except Unanswered:
+      status = 404
+    except (asyncio.TimeoutError, CircuitOpen):
+      status = 503
+    except Exception:   # one bad message must not end the conversation
+      status = 500
+    await web_socket.send(json.dumps({ 'id': id, 'status': status }))
+
+async def converse(scope, info, matches, web_socket):
+  conversation, headers = await conversations(scope)
+  await web_socket.accept()
+  await web_socket.send(json.dumps({ 'session': conversation.id }))
+  queue = asyncio.Queue(_ws_backlog)
+  worker = asyncio.ensure_future(_converse(conversation, queue, web_socket))
+  try:
+    while True:
+      receiving = asyncio.ensure_future(web_socket.receive())
+      await asyncio.wait((receiving, worker), return_when=asyncio.FIRST_COMPLETED)
+      if not receiving.done():   # the worker died
+        receiving.cancel()
+        worker.exception()    # marks its error as retrieved
+        try:
+          await web_socket.close(1011)
+        except Exception:   # the client is gone already
+          pass
+        break
+      data = receiving.result()
+      if data is None:   # disconnected
+        break
+      id, text = _frame(data)
+      try:
+        queue.put_nowait((id, text))
+      except asyncio.QueueFull:
+        await web_socket.send(json.dumps({ 'id': id, 'status': 429 }))
+  finally:
+    worker.cancel()
+
+_intents = counter('whizbot_intents_total', 'Messages answered, by intent')
+
+class Unanswered(Exception):
+  """Watson gave no output for the message"""
+
+async def reply(conversation, text, learn=True):
+  try:
+    return [e async for part in fragments(conversation, text, learn) for e in part]
+  except Unanswered:
+    return None
+
+async def fragments(conversation, text, learn=True):
+  state = conversation.watson
   if text == '':
-    return json_response(assistant(intents=['welcome']).text)
+    _intents.inc(intent='welcome')
+    yield (await assistant(intents=['welcome'], state=state)).text
+    return
   
-  if not _weather:
-    res = assistant(text)
+  if not conversation.weather:
+    speculation = speculate(text)
+    try:
+      res = await assistant(text, state=state)
+    except BaseException:
+      _discard(speculation)
+      raise
     if res is None:
-      return json_response(res.data, 404)
+      _discard(speculation)
+      raise Unanswered(text)
     
     if not res.intent or res.confidence < 0.9:
-      ret = wikipedia.snippet(text)
+      _intents.inc(intent='open-ended')
+      ret = await (speculation or wikipedia.snippet(text))
       if not ret:
-        return retry()
+        yield await retry(conversation)
+        return
       
-      wikibot[text, ret.caption] = ret.text
-      return json_response(split(ret.text))
+      if learn:
+        wikibot[text, ret.caption] = ret.text
+      yield ret.text.lines
+      return
+    _discard(speculation)
   else:
-    res = assistant(text, bypass=True)
+    res = await assistant(text, bypass=True, state=state)
     if res and res.intent and res.confidence >= 0.9:
-      _weather = None
-      return json_response(res.text)
+      conversation.weather = None
+      yield res.text
+      return
       
-  if _weather or res.intent == 'weather':
-    if _weather:
-      notions = _weather
+  if conversation.weather or res.intent == 'weather':
+    _intents.inc(intent='weather')
+    if conversation.weather:
+      notions = conversation.weather
       location = text
     else:
       ret = dict(res.entities['notion'])
@@ -61,17 +327,23 @@ async def message(scope, info, matches, content):
 
       locations = list(ret.values())
       location = locations[0].value if locations else None
-      if not location and not weather:
-        _weather = notions
-        return json_response(res.text)
+      if not location and not conversation.location:
+        conversation.weather = notions
+        yield res.text
+        return
     
-    if location and not weather.location(location):
-      return retry()
+    if location:
+      location = await weather.location(location)
+      if not location:
+        yield await retry(conversation)
+        return
+      conversation.location = location
     
-    _weather = None
-    obs = weather.current()
+    conversation.weather = None
+    obs = await weather.current(conversation.location)
     if not obs:
-      return retry()
+      yield await retry(conversation)
+      return
     
     answer = []
     if obs.observation:
@@ -91,19 +363,56 @@ async def message(scope, info, matches, content):
         answer.append(f"wind: {e.direction} {e.speed}")
     
     if not answer:
-      return retry()
+      yield await retry(conversation)
+      return
       
-    return json_response(answer)
+    yield answer
+    return
       
+  # answers learned by the wikibot have generated intent names; count them under one label
+  _intents.inc(intent='learned' if isinstance(res, (_watson.Answer, _watson.Output_1)) else res.intent)
   if res.intent == 'chuck_norris':
     category = res.entities['domain'].get('value')
     if ('notion', 'categories') in res.entities:
-      ret = [chuck_norris.categories()]
-    elif ('notion', 'joke') in res.entities:
-      ret = chuck_norris.random(category)
-    else:
-      ret = chuck_norris.random(category, 3)
-    return json_response(ret)
+      yield [await chuck_norris.categories()]
+      return
+    count = 1 if ('notion', 'joke') in res.entities else 3
+    empty = True
+    async for joke in chuck_norris.stream(category, count):
+      empty = False
+      yield [joke]
+    if empty:
+      yield await retry(conversation)
+    return
   
-  return json_response(res.text)
-      
+  yield res.text
+
+def _stats(name, help, source, stats, type='counter'):
+  for stat in stats:
+    gauge(f"whizbot_{name}_{stat}{'_total' if type == 'counter' else ''}", f"{help}: {stat}",
+          lambda stat=stat: ((labels, getattr(e, stat)) for labels, e in source()), type)
+
+_caches = lambda: (({ 'cache': k }, v) for k, v in cache.registry.items())
+_breakers = lambda: (({ 'service': k }, v) for k, v in breaker.registry.items())
+_flights = lambda: [({ 'layer': 'http' }, request.flights), ({ 'layer': 'watson' }, _watson.flights)]
+_stats('cache', 'Cache', _caches, ['hits', 'misses', 'shared_hits'])
+_stats('cache', 'Cache', _caches, ['hit_rate', 'bytes'], 'gauge')
+gauge('whizbot_cache_entries', 'Cache entries', lambda: ((labels, len(e)) for labels, e in _caches()))
+gauge('whizbot_cache_store_pending', 'Pending shared store writes',
+      lambda: ((labels, len(e.writes)) for labels, e in _caches() if e.writes is not None))
+_stats('breaker', 'Circuit breaker', _breakers, ['trips', 'rejected'])
+gauge('whizbot_breaker_open', 'Circuit breaker open (1) or half-open (0.5)',
+      lambda: ((labels, { 'closed': 0, 'half-open': 0.5, 'open': 1 }[e.state]) for labels, e in _breakers()))
+_stats('flights', 'Single-flight', _flights, ['collapsed'])
+_stats('sessions', 'Watson session pool', lambda: [({}, assistant.sessions)],
+       ['created', 'renewed', 'failed', 'acquired', 'misses'])
+gauge('whizbot_sessions_idle', 'Idle pooled Watson sessions', lambda: [({}, len(assistant.sessions))])
+_stats('learning', 'Wikibot write-behind queue', lambda: [({}, wikibot.writes)], ['written', 'failed', 'dropped'])
+gauge('whizbot_learning_pending', 'Pending wikibot writes', lambda: [({}, len(wikibot.writes))])
+gauge('whizbot_answers_loaded', 'Wikibot answer index loaded from the workspace', lambda: [({}, int(wikibot.loaded))])
+gauge('whizbot_answers', 'Wikibot answers indexed', lambda: [({}, len(wikibot.answers))])
+gauge('whizbot_jokes_buffered', 'Buffered jokes, by category',
+      lambda: (({ 'category': k or '' }, v) for k, v in chuck_norris.buffered().items()))
+
+async def metrics(scope, info, matches, content):
+  return text_response(render())
@@ -7,14 +7,29 @@ import uvicorn
 from _bareasgi import Application
 from bareasgi_static import add_static_file_provider
 
-from engine import message
+from config import setting
+from engine import message, batch, converse, metrics, startup
+from util.supervisor import Supervisor
 
 here = os.path.abspath(os.path.dirname(__file__))
 
-app = Application()
+app = Application(startup_handlers=[startup])
 app.http_router.add({'POST'}, '/message', message)
+app.http_router.add({'POST'}, '/message/batch', batch)
+app.http_router.add({'GET'}, '/metrics', metrics)
+app.ws_router.add('/conversation', converse)
 
 add_static_file_provider(app, os.path.join(here, 'static'), index_filename='index.html')
 
-port = int(os.getenv('PORT', '80'))
-uvicorn.run(app, host='0.0.0.0', port=port)
+def _config():
+  return uvicorn.Config(app, host='0.0.0.0', port=int(os.getenv('PORT', '80')))
+
+def serve(sockets=None):
+  uvicorn.Server(_config()).run(sockets=sockets)
+
+if __name__ == '__main__':
+  processes = setting('processes', 1)
+  if processes > 1:
+    Supervisor(serve, processes, setting('restart_grace', 30.0)).run([_config().bind_socket()])
+  else:
+    serve()
@@ -0,0 +1,96 @@
+import asyncio
+
+import pytest
+
+from util import breaker
+from util.breaker import CircuitBreaker, CircuitOpen
+
+
+class Clock:
+  def __init__(self):
+    self.now = 1000.0
+    
+  def __call__(self):
+    return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+  ret = Clock()
+  monkeypatch.setattr(breaker, 'monotonic', ret)
+  return ret
+
+def _breaker():
+  return CircuitBreaker('test', threshold=0.5, window=4, minimum=2, cooldown=30.0)
+
+async def _ok():
+  return 'ok'
+
+async def _fail():
+  raise IOError('down')
+
+def _call(b, func):
+  return asyncio.run(b(func))
+
+def test_trips_after_threshold(clock):
+  b = _breaker()
+  _call(b, _ok)
+  with pytest.raises(IOError):
+    _call(b, _fail)
+  assert b.state == 'open'
+  assert b.trips == 1
+  with pytest.raises(CircuitOpen):
+    _call(b, _ok)
+  assert b.rejected == 1
+
+def test_probe_closes_after_cooldown(clock):
+  b = _breaker()
+  for i in range(2):
+    b.failure(b.allow())
+  assert b.state == 'open'
+  clock.now += 30
+  assert b.state == 'half-open'
+  probe = b.allow()
+  assert probe is not None
+  assert b.allow() is None    # one probe at a time
+  b.success(probe)
+  assert b.state == 'closed'
+  assert _call(b, _ok) == 'ok'
+
+def test_failed_probe_reopens(clock):
+  b = _breaker()
+  for i in range(2):
+    b.failure(b.allow())
+  clock.now += 30
+  b.failure(b.allow())
+  assert b.state == 'open'
+  clock.now += 29
+  assert b.state == 'open'
+  clock.now += 1
+  assert b.state == 'half-open'
+
+def test_stale_results_are_ignored(clock):
+  b = _breaker()
+  slow_ok, slow_fail = b.allow(), b.allow()   # admitted before the trip
+  for i in range(2):
+    b.failure(b.allow())
+  assert b.state == 'open'
+  b.success(slow_ok)
+  assert b.state == 'open'
+  clock.now += 10
+  b.failure(slow_fail)    # would push back the reopening
+  clock.now += 20
+  assert b.state == 'half-open'
+  
+  b.success(b.allow())    # reset by the probe
+  assert b.state == 'closed'
+  for i in range(4):
+    b.failure(slow_fail)    # a result from before the reset arrives late
+  assert b.state == 'closed'
+
+def test_failed_results_count_as_failures(clock):
+  b = CircuitBreaker('test', failed=lambda res: res is None, minimum=2, window=4)
+  async def empty():
+    return None
+  for i in range(2):
+    assert _call(b, empty) is None
+  assert b.state == 'open'
@@ -0,0 +1,50 @@
+import asyncio, json, threading
+
+from util.cache import Journal
+
+
+def test_load_returns_pairs_in_write_order(tmp_path):
+  journal = Journal(str(tmp_path / 'j.jsonl'))
+  assert journal.load() == []
+  journal.append('a', 1)
+  journal.append('b', [2, 3])
+  journal.append('a', { 'x': 4 })
+  assert journal.load() == [('a', 1), ('b', [2, 3]), ('a', { 'x': 4 })]
+
+def test_load_skips_unreadable_lines(tmp_path):
+  path = tmp_path / 'j.jsonl'
+  path.write_text('["a", 1]\n5\n["b"]\n{"k": 1}\nnull\n["c", 2\n["d", 3]\n', encoding='utf-8')
+  assert Journal(str(path)).load() == [('a', 1), ('d', 3)]
+
+def test_compact_keeps_the_last_value_per_key(tmp_path):
+  journal = Journal(str(tmp_path / 'j.jsonl'))
+  for key, value in [('a', 1), ('b', 2), ('a', 3), (['c', 1], 4), (['c', 1], 5)]:
+    journal.append(key, value)
+  assert journal.compact() == 3
+  assert sorted(journal.load(), key=json.dumps) == [('a', 3), ('b', 2), (['c', 1], 5)]
+
+def test_appends_racing_a_compaction_are_kept(tmp_path):
+  journal = Journal(str(tmp_path / 'j.jsonl'))
+  done = threading.Event()
+  def compact():
+    while not done.is_set():
+      journal.compact()
+  thread = threading.Thread(target=compact)
+  thread.start()
+  try:
+    for i in range(300):
+      journal.append(f"k{i}", i)
+  finally:
+    done.set()
+    thread.join()
+  assert sorted(v for k, v in journal.load()) == list(range(300))
+
+def test_put_appends_in_the_background(tmp_path):
+  journal = Journal(str(tmp_path / 'j.jsonl'))
+  async def main():
+    journal.put('a', 1)
+    journal.put('a', 2)   # merged with the pending write
+    journal.put('b', 3)
+    await journal.writes.flush()
+  asyncio.run(main())
+  assert sorted(journal.load()) == [('a', 2), ('b', 3)]
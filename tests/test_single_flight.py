@@ -0,0 +1,65 @@
+import asyncio
+
+import pytest
+
+from util.aio import SingleFlight
+
+
+def test_concurrent_calls_share_one_flight():
+  calls = []
+  async def fetch(key):
+    calls.append(key)
+    await asyncio.sleep(0.01)
+    return key.upper()
+    
+  async def main():
+    flights = SingleFlight()
+    ret = await asyncio.gather(*(flights(key, fetch, key) for key in ['a', 'a', 'a', 'b']))
+    return flights, ret
+    
+  flights, ret = asyncio.run(main())
+  assert ret == ['A', 'A', 'A', 'B']
+  assert sorted(calls) == ['a', 'b']
+  assert flights.collapsed == 2
+  assert len(flights) == 0
+
+def test_errors_reach_every_caller():
+  async def fail():
+    await asyncio.sleep(0.01)
+    raise ValueError('down')
+    
+  async def main():
+    flights = SingleFlight()
+    return await asyncio.gather(flights('k', fail), flights('k', fail), return_exceptions=True)
+    
+  ret = asyncio.run(main())
+  assert [type(e) for e in ret] == [ValueError, ValueError]
+
+def test_cancelling_a_caller_leaves_the_flight_running():
+  async def fetch():
+    await asyncio.sleep(0.02)
+    return 1
+    
+  async def main():
+    flights = SingleFlight()
+    first = asyncio.ensure_future(flights('k', fetch))
+    second = asyncio.ensure_future(flights('k', fetch))
+    await asyncio.sleep(0)
+    first.cancel()
+    with pytest.raises(asyncio.CancelledError):
+      await first
+    return await second
+    
+  assert asyncio.run(main()) == 1
+
+def test_later_calls_start_a_new_flight():
+  calls = []
+  async def fetch():
+    calls.append(1)
+    return len(calls)
+    
+  async def main():
+    flights = SingleFlight()
+    return [await flights('k', fetch), await flights('k', fetch)]
+    
+  assert asyncio.run(main()) == [1, 2]
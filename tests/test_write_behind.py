@@ -0,0 +1,77 @@
+import asyncio
+
+from util.aio import WriteBehind
+
+
+def test_pending_writes_merge_by_key():
+  written = []
+  async def write(key, value):
+    written.append((key, value))
+    
+  async def main():
+    writes = WriteBehind(write, batch=1)
+    writes.put('a', 1)
+    writes.put('b', 1)
+    writes.put('b', 2)   # still pending: replaces 1
+    await writes.flush()
+    return writes
+    
+  writes = asyncio.run(main())
+  assert written == [('a', 1), ('b', 2)]
+  assert writes.written == 2
+
+def test_writes_beyond_maxsize_are_dropped():
+  written = []
+  async def write(key, value):
+    written.append(key)
+    
+  async def main():
+    writes = WriteBehind(write, maxsize=2)
+    assert writes.put('a', 1)
+    assert writes.put('b', 1)
+    assert not writes.put('c', 1)
+    assert writes.put('a', 2)    # merging into a pending key needs no room
+    await writes.flush()
+    return writes
+    
+  writes = asyncio.run(main())
+  assert sorted(written) == ['a', 'b']
+  assert writes.dropped == 1
+
+def test_failed_writes_are_retried_with_backoff(monkeypatch):
+  attempts = []
+  async def write(key, value):
+    attempts.append(key)
+    if len(attempts) < 3:
+      raise IOError('down')
+    
+  delays = []
+  sleep = asyncio.sleep
+  async def _sleep(secs):
+    delays.append(secs)
+    await sleep(0)
+  monkeypatch.setattr(asyncio, 'sleep', _sleep)
+    
+  async def main():
+    writes = WriteBehind(write, retries=3, backoff=0.5)
+    writes.put('a', 1)
+    await writes.flush()
+    return writes
+    
+  writes = asyncio.run(main())
+  assert attempts == ['a'] * 3
+  assert delays == [0.5, 1.0]
+  assert (writes.written, writes.failed) == (1, 0)
+
+def test_writes_failing_every_retry_are_counted():
+  async def write(key, value):
+    raise IOError('down')
+    
+  async def main():
+    writes = WriteBehind(write, retries=1, backoff=0)
+    writes.put('a', 1)
+    await writes.flush()
+    return writes
+    
+  writes = asyncio.run(main())
+  assert (writes.written, writes.failed) == (0, 1)
@@ -1,4 +1,5 @@
-import os, re
+import os, re, asyncio
+from functools import partial
 from platform import python_version_tuple as get_pyversion
 from statistics import mean as _mean, StatisticsError
 from time import time_ns
@@ -6,6 +7,9 @@ from datetime import timedelta
 from concurrent.futures import ThreadPoolExecutor as _Executor      
 from html.parser import HTMLParser as _HTMLParser
 
+from util.deadline import bound
+from util.text import Text, normalize, lines, join, squeeze
+
 from munch import munchify
 
 
@@ -134,8 +138,12 @@ class Timer:
   def restart(self):
     return self()
     
-  def __call__(self):
-    self._time = time_ns()
+  @property
+  def started(self):
+    return self._time
+    
+  def __call__(self, at=None):
+    self._time = time_ns() if at is None else at
   
   def __bool__(self):
     if self._elapsed <= self._duration.nanos:
@@ -171,13 +179,11 @@ def bisect(self, value, key=None):
     key = lambda e: e
   return _bisect(self, value, key, 0, len(self))
   
-_newline = r'\s*[\n\r]+\s*'
-
 def strip(text):
-  return re.sub(_newline, '', text)
+  return join(text)
 
 def split(text):
-  return re.split(_newline, text)
+  return lines(text)
 
 def casefold(self):
   return str(self).casefold()
@@ -187,46 +193,67 @@ def sign(self):
     return 0
   return -1 if self < 0 else 1
 
-class Future:
-  def __init__(self, func, executor):
-    self._func = func
-    self._executor = executor
-  
-  def __call__(self, *args, **kw):
-    self._executor.submit(self._func, *args, **kw)
-    return self
-
 class Executor:
-  def __init__(self, src=None):    #FIXME
-    self._executor = None
-    self._futures = None
-  
-  def __call__(self, *args, **kw):    #FIXME
-    _range = range(*args, **kw)
-    self._executor = _Executor(max_workers=len(_range))
-    self._futures = []
-    yield from _range
-    
-  def __bool__(self):
-    return bool(self._executor)
+  """Bounded worker pool for blocking calls"""
+  _shared = None
+  
+  def __init__(self, max_workers=32, limit=None, timeout=None):
+    self._executor = _Executor(max_workers=max_workers, thread_name_prefix='executor')
+    self._limit = limit or max_workers
+    self._semaphore = None
+    self.timeout = timeout
     
-  def __getitem__(self, func):
-    return Future(func, self)
+  @classmethod
+  def shared(cls):
+    if cls._shared is None:
+      cls._shared = cls()
+    return cls._shared
   
-  def __iter__(self):
-    if self:
-      for future in self._futures:
-        yield future.result()
-      self._executor.shutdown(False)
-      self._executor = None
-      
-  def collect(self):
-    return tuple(self)
-  
-  def submit(self, func, *args, **kw):
-    if self:
-      future = self._executor.submit(func, *args, **kw)
-      self._futures.append(future)
+  @classmethod
+  def configure(cls, **kw):
+    if cls._shared is not None:
+      cls._shared.shutdown()
+    cls._shared = cls(**kw)
+    return cls._shared
+  
+  def _release(self, loop):
+    try:
+      loop.call_soon_threadsafe(self._semaphore.release)
+    except RuntimeError:    # loop closed
+      pass
+  
+  async def __call__(self, func, *args, **kw):
+    """Runs `func` in a thread; cancelling only drops calls not yet started"""
+    loop = asyncio.get_event_loop()
+    timeout = bound(self.timeout)
+    start = loop.time()
+    if self._semaphore is None:
+      self._semaphore = asyncio.Semaphore(self._limit)
+    await asyncio.wait_for(self._semaphore.acquire(), timeout)
+    try:
+      future = self._executor.submit(partial(func, *args, **kw))
+    except BaseException:
+      self._semaphore.release()
+      raise
+    future.add_done_callback(lambda e: self._release(loop))
+    if timeout is not None:
+      timeout = max(timeout - (loop.time() - start), 0)
+    try:
+      return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), timeout)
+    except BaseException:
+      future.cancel()   # only takes if its thread has not started it yet
+      raise
+  
+  async def map(self, func, *iterables, return_exceptions=False):
+    tasks = [asyncio.ensure_future(self(func, *args)) for args in zip(*iterables)]
+    try:
+      return await asyncio.gather(*tasks, return_exceptions=return_exceptions)
+    finally:
+      for task in tasks:
+        task.cancel()
+  
+  def shutdown(self, wait=False):
+    self._executor.shutdown(wait)
 
 class HTMLParser(_HTMLParser):
   def __init__(self, html=None):
@@ -248,4 +275,4 @@ class HTMLParser(_HTMLParser):
     
   @property
   def text(self):
-    return re.sub(r" +", " ", ''.join(self._text))
+    return squeeze(''.join(self._text))
@@ -0,0 +1,83 @@
+import asyncio, logging
+from collections import OrderedDict as _OrderedDict
+
+from util import Executor
+from util.deadline import detach
+
+_logger = logging.getLogger(__name__)
+
+
+def run(func, *args, **kw):
+  return Executor.shared()(func, *args, **kw)
+
+class SingleFlight:
+  """Coalesces concurrent calls sharing a key"""
+  def __init__(self):
+    self._flights = {}
+    self.collapsed = 0
+    
+  def __len__(self):
+    return len(self._flights)
+    
+  async def __call__(self, key, func, *args, **kw):
+    future = self._flights.get(key)
+    if future is None:
+      future = self._flights[key] = asyncio.ensure_future(func(*args, **kw))
+      future.add_done_callback(lambda e: self._done(key, e))
+    else:
+      self.collapsed += 1
+    return await asyncio.shield(future)
+  
+  def _done(self, key, future):
+    if self._flights.get(key) is future:
+      del self._flights[key]
+
+class WriteBehind:
+  """Background writes, merged by key and retried with backoff"""
+  def __init__(self, write, maxsize=1000, batch=8, retries=3, backoff=1.0):
+    self._write = write
+    self._pending = _OrderedDict()
+    self._task = None
+    self.maxsize = maxsize
+    self.batch = batch
+    self.retries = retries
+    self.backoff = backoff
+    self.written = 0
+    self.failed = 0
+    self.dropped = 0
+    
+  def __len__(self):
+    return len(self._pending)
+    
+  def put(self, key, value):
+    """Queues a write; returns False if the backlog is full"""
+    if key not in self._pending and len(self._pending) >= self.maxsize:
+      self.dropped += 1
+      return False
+    self._pending[key] = value
+    if self._task is None or self._task.done():
+      self._task = detach(self._drain())
+    return True
+  
+  async def _drain(self):
+    pending = self._pending
+    while pending:
+      batch = [pending.popitem(last=False) for i in range(min(self.batch, len(pending)))]
+      await asyncio.gather(*(self._apply(key, value) for key, value in batch))
+      
+  async def _apply(self, key, value):
+    for attempt in range(self.retries + 1):
+      try:
+        await self._write(key, value)
+        self.written += 1
+        return
+      except Exception:
+        if attempt == self.retries:
+          self.failed += 1
+          _logger.exception('Write of %r failed', key)
+          return
+        await asyncio.sleep(self.backoff * 2 ** attempt)
+        
+  async def flush(self):
+    if self._task is not None:
+      await asyncio.shield(self._task)
@@ -0,0 +1,98 @@
+import asyncio
+from collections import deque
+from time import monotonic
+
+
+class CircuitOpen(Exception):
+  """Raised instead of calling a service whose circuit is open"""
+
+class CircuitBreaker:
+  """Fails calls fast while too many recent calls to a service failed"""
+  defaults = dict(threshold=0.5, window=20, minimum=5, cooldown=30.0)
+  
+  def __init__(self, name, failed=None, **kw):
+    kw = dict(self.defaults, **kw)
+    self.name = name
+    self.threshold = kw['threshold']
+    self.minimum = kw['minimum']
+    self.cooldown = kw['cooldown']
+    self._failed = failed
+    self._results = deque(maxlen=kw['window'])
+    self._opened = None
+    self._probing = False
+    self._generation = 0
+    self.trips = 0
+    self.rejected = 0
+    registry[name] = self
+    
+  @classmethod
+  def configure(cls, **kw):
+    cls.defaults = dict(cls.defaults, **kw)
+    
+  @property
+  def state(self):
+    if self._opened is None:
+      return 'closed'
+    if monotonic() - self._opened < self.cooldown:
+      return 'open'
+    return 'half-open'
+    
+  def allow(self):
+    """The admitted call's generation, or None if rejected"""
+    state = self.state
+    if state == 'closed':
+      return self._generation
+    if state == 'half-open' and not self._probing:
+      self._probing = True
+      return self._generation
+    return None
+  
+  def _transition(self, opened):
+    self._opened = opened
+    self._probing = False
+    self._generation += 1
+  
+  def success(self, generation=None):
+    if generation is not None and generation != self._generation:   # stale
+      return
+    if self._opened is not None:    # successful probe
+      self._transition(None)
+      self._results.clear()
+    self._results.append(True)
+    
+  def failure(self, generation=None):
+    if generation is not None and generation != self._generation:   # stale
+      return
+    if self._opened is not None:    # failed probe
+      self._transition(monotonic())
+      return
+    results = self._results
+    results.append(False)
+    if len(results) >= self.minimum and results.count(False) / len(results) >= self.threshold:
+      self._transition(monotonic())
+      self.trips += 1
+      
+  async def __call__(self, func, *args, **kw):
+    generation = self.allow()
+    if generation is None:
+      self.rejected += 1
+      raise CircuitOpen(self.name)
+    try:
+      ret = await func(*args, **kw)
+    except asyncio.CancelledError:
+      if generation == self._generation and self._opened is not None:   # cancelled probe
+        self._probing = False
+      raise
+    except Exception:
+      self.failure(generation)
+      raise
+    if self._failed and self._failed(ret):
+      self.failure(generation)
+    else:
+      self.success(generation)
+    return ret
+
+registry = {}
+
+def server_error(res):
+  return res.status_code >= 500
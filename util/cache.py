@@ -0,0 +1,214 @@
+import os, json
+from collections import OrderedDict as _OrderedDict
+from contextlib import contextmanager
+from time import monotonic
+
+try:
+  import fcntl
+except ImportError:
+  fcntl = None
+
+from util.aio import run, WriteBehind
+
+
+class Cache:
+  """Bounded LRU mapping with expiry, optionally backed by a shared store"""
+  def __init__(self, maxsize=1024, ttl=None, refresh=False, maxbytes=None, name=None,
+               store=None, encode=json.dumps, decode=json.loads, backlog=1000):
+    assert maxsize > 0
+    assert name or not store
+    if name:
+      registry[name] = self
+    self.name = name
+    self._store = store
+    self._encode = encode
+    self._decode = decode
+    self.writes = WriteBehind(self._write, backlog) if store else None
+    self._data = _OrderedDict()
+    self.maxsize = maxsize
+    self.maxbytes = maxbytes
+    self.ttl = ttl
+    self._refresh = refresh
+    self.bytes = 0
+    self.hits = 0
+    self.misses = 0
+    self.shared_hits = 0
+
+  def _expiry(self):
+    return monotonic() + self.ttl if self.ttl else None
+
+  def _expired(self, expiry):
+    return expiry is not None and expiry <= monotonic()
+
+  def __len__(self):
+    return len(self._data)
+
+  def __contains__(self, key):
+    entry = self._data.get(key)
+    return entry is not None and not self._expired(entry[0])
+
+  def _shared_key(self, key):
+    return f"{self.name}:{json.dumps(key)}"
+  
+  def _local(self, key):
+    expiry, size, value = self._data[key]
+    if self._expired(expiry):   # kept around for `peek`, until evicted
+      raise KeyError(key)
+    if self._refresh:
+      self._data[key] = (self._expiry(), size, value)
+    self._data.move_to_end(key)
+    self.hits += 1
+    return value
+    
+  def __getitem__(self, key):
+    try:
+      return self._local(key)
+    except KeyError:
+      self.misses += 1
+      raise
+
+  def get(self, key, default=None):
+    try:
+      return self[key]
+    except KeyError:
+      return default
+    
+  async def fetch(self, key, default=None):
+    """Like `get`, also looking in the shared store"""
+    try:
+      return self._local(key)
+    except KeyError:
+      pass
+    raw = await run(self._store.get, self._shared_key(key)) if self._store else None
+    if raw is None:
+      self.misses += 1
+      return default
+    value = self._decode(raw)
+    self._put(key, value, len(raw))
+    self.shared_hits += 1
+    return value
+
+  def peek(self, key, default=None):
+    """The value for `key`, even if expired"""
+    entry = self._data.get(key)
+    return default if entry is None else entry[2]
+
+  def set(self, key, value, size=0, share=True):
+    self._put(key, value, size)
+    if share and self.writes is not None:
+      self.writes.put(self._shared_key(key), self._encode(value))
+    
+  def _write(self, key, raw):
+    return run(self._store.set, key, raw, self.ttl)
+    
+  def _put(self, key, value, size):
+    if key in self._data:
+      del self[key]
+    if self.maxbytes and size > self.maxbytes:
+      return
+    self._data[key] = (self._expiry(), size, value)
+    self.bytes += size
+    self.purge()
+
+  def __setitem__(self, key, value):
+    self.set(key, value)
+
+  def __delitem__(self, key):
+    expiry, size, value = self._data.pop(key)
+    self.bytes -= size
+
+  def pop(self, key, default=None):
+    try:
+      value = self[key]
+    except KeyError:
+      return default
+    del self[key]
+    return value
+
+  def clear(self):
+    self._data.clear()
+    self.bytes = 0
+
+  def purge(self):
+    data = self._data
+    while data:
+      key, (expiry, size, value) = next(iter(data.items()))
+      if not self._expired(expiry):
+        break
+      del self[key]
+    while data and (len(data) > self.maxsize or self.maxbytes and self.bytes > self.maxbytes):
+      del self[next(iter(data))]
+
+  def items(self):
+    return [(key, value) for key, (expiry, size, value) in self._data.items() if not self._expired(expiry)]
+
+  @property
+  def hit_rate(self):
+    total = self.hits + self.misses
+    return self.hits / total if total else None
+
+
+registry = {}
+
+
+class Journal:
+  """Append-only JSON-lines file of (key, value) pairs"""
+  def __init__(self, path, backlog=1000):
+    self.path = path
+    self.writes = WriteBehind(self._write, backlog)
+    
+  @contextmanager
+  def _lock(self):
+    if fcntl is None:
+      yield
+      return
+    with open(f"{self.path}.lock", 'w') as f:
+      fcntl.flock(f, fcntl.LOCK_EX)
+      try:
+        yield
+      finally:
+        fcntl.flock(f, fcntl.LOCK_UN)
+
+  def load(self):
+    ret = []
+    try:
+      with open(self.path, encoding='utf-8') as f:
+        for line in f:
+          try:
+            key, value = json.loads(line)
+          except (ValueError, TypeError):   # torn write, or not a pair
+            continue
+          ret.append((key, value))
+    except FileNotFoundError:
+      pass
+    return ret
+
+  def append(self, key, value):
+    with self._lock(), open(self.path, 'a', encoding='utf-8') as f:
+      f.write(json.dumps([key, value]) + '\n')
+      
+  def put(self, key, value):
+    return self.writes.put(json.dumps(key), (key, value))
+  
+  def _write(self, _, pair):
+    return run(self.append, *pair)
+
+  def rewrite(self, pairs):
+    with self._lock():
+      self._rewrite(pairs)
+      
+  def compact(self):
+    """Keeps only the last value written for each key"""
+    with self._lock():
+      latest = {}
+      for key, value in self.load():
+        latest[json.dumps(key)] = (key, value)
+      self._rewrite(latest.values())
+    return len(latest)
+  
+  def _rewrite(self, pairs):
+    tmp = f"{self.path}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+      for key, value in pairs:
+        f.write(json.dumps([key, value]) + '\n')
+    os.replace(tmp, self.path)
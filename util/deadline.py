@@ -0,0 +1,96 @@
+import asyncio
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import monotonic
+
+from util.metrics import histogram, counter
+from util.breaker import server_error
+
+_current = ContextVar('deadline', default=None)
+_spent = histogram('whizbot_budget_seconds', 'Request time budget spent, by stage')
+_latency = histogram('whizbot_stage_seconds', 'Latency of each outbound call, by stage')
+_errors = counter('whizbot_upstream_errors_total', 'Failed outbound calls, by stage')
+
+
+class Deadline:
+  """Time budget of the request being handled"""
+  def __init__(self, budget):
+    self.budget = budget
+    self.start = monotonic()
+    self.expiry = self.start + budget
+    self.spent = {}
+    self._token = None
+    
+  @classmethod
+  def current(cls):
+    return _current.get()
+    
+  @property
+  def remaining(self):
+    return max(self.expiry - monotonic(), 0)
+  
+  @property
+  def elapsed(self):
+    return monotonic() - self.start
+  
+  def __enter__(self):
+    self._token = _current.set(self)
+    return self
+  
+  def __exit__(self, *exc):
+    _current.reset(self._token)
+    for stage, secs in self.spent.items():
+      _spent.observe(secs, stage=stage)
+    _spent.observe(self.elapsed, stage='total')
+
+def remaining(default=None):
+  deadline = _current.get()
+  return deadline.remaining if deadline else default
+
+def bound(timeout):
+  left = remaining()
+  if left is None:
+    return timeout
+  return left if timeout is None else min(timeout, left)
+
+class _Call:
+  __slots__ = ('failed',)
+  def __init__(self):
+    self.failed = False
+    
+  def fail(self):
+    self.failed = True
+    
+  def check(self, res):
+    if server_error(res):
+      self.failed = True
+    return res
+
+@contextmanager
+def spend(stage):
+  """Times the call within as `stage`, counting failures"""
+  deadline = _current.get()
+  start = monotonic()
+  call = _Call()
+  try:
+    yield call
+  except asyncio.CancelledError:
+    raise
+  except Exception:
+    call.failed = True
+    raise
+  finally:
+    if call.failed:
+      _errors.inc(stage=stage)
+    elapsed = monotonic() - start
+    _latency.observe(elapsed, stage=stage)
+    if deadline is not None:
+      deadline.spent[stage] = deadline.spent.get(stage, 0) + elapsed
+
+async def _detached(aw):
+  _current.set(None)    # only affects this task's copy of the context
+  return await aw
+
+def detach(aw):
+  """Schedules `aw` free of the current deadline"""
+  return asyncio.ensure_future(_detached(aw))
@@ -0,0 +1,42 @@
+import re, threading
+from html import unescape
+
+from util import HTMLParser
+from util.text import squeeze
+
+_tag = re.compile(r"</?[A-Za-z][^<>]*>")
+_local = threading.local()
+_separator = '\0'
+
+
+def _parser():
+  ret = getattr(_local, 'parser', None)
+  if ret is None:
+    ret = _local.parser = HTMLParser()
+  return ret
+
+def _fast(html):
+  if '<' in html:
+    html = _tag.sub('', html)
+    if '<' in html:   # comments, declarations or stray brackets
+      return None
+  if '&' in html:
+    html = unescape(html)
+  return squeeze(html)
+
+def strip_html(html):
+  if html is None:
+    return ''
+  ret = _fast(html)
+  if ret is None:
+    ret = _parser()(html).text
+  return ret
+
+def strip_all(htmls):
+  htmls = list(htmls)
+  if any(e is None or _separator in e for e in htmls):
+    return [strip_html(e) for e in htmls]
+  ret = _fast(_separator.join(htmls))
+  if ret is None:
+    return [strip_html(e) for e in htmls]
+  return ret.split(_separator) if htmls else []
@@ -0,0 +1,106 @@
+from bisect import bisect_left
+
+
+def _key(labels):
+  return tuple(sorted(labels.items()))
+
+def _escape(value):
+  return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+def _labels(labels):
+  if not labels:
+    return ''
+  return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in sorted(labels.items())) + '}'
+
+class Counter:
+  type = 'counter'
+  
+  def __init__(self, name, help=''):
+    self.name = name
+    self.help = help
+    self._values = {}
+    
+  def inc(self, value=1, **labels):
+    key = _key(labels)
+    self._values[key] = self._values.get(key, 0) + value
+    
+  def samples(self):
+    for key, value in self._values.items():
+      yield self.name, dict(key), value
+
+class Histogram:
+  type = 'histogram'
+  buckets = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+  
+  def __init__(self, name, help='', buckets=None):
+    self.name = name
+    self.help = help
+    if buckets:
+      self.buckets = tuple(sorted(buckets))
+    self._series = {}   # labels -> [bucket counts..., +Inf count, sum]
+    
+  def observe(self, value, **labels):
+    key = _key(labels)
+    series = self._series.get(key)
+    if series is None:
+      series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+    series[bisect_left(self.buckets, value)] += 1
+    series[-1] += value
+    
+  def series(self):
+    for key, series in self._series.items():
+      counts, total = series[:-1], 0
+      cumulative = []
+      for e in counts:
+        total += e
+        cumulative.append(total)
+      yield dict(key), cumulative, total, series[-1]
+      
+  def samples(self):
+    bounds = [*(str(e) for e in self.buckets), '+Inf']
+    for labels, cumulative, count, sum in self.series():
+      for le, value in zip(bounds, cumulative):
+        yield f"{self.name}_bucket", dict(labels, le=le), value
+      yield f"{self.name}_count", labels, count
+      yield f"{self.name}_sum", labels, sum
+
+class Gauge:
+  """Values read at scrape time from `collect()`"""
+  def __init__(self, name, help, collect, type='gauge'):
+    self.name = name
+    self.help = help
+    self.type = type
+    self._collect = collect
+    
+  def samples(self):
+    for labels, value in self._collect():
+      if value is not None:
+        yield self.name, labels, value
+
+registry = {}
+
+def _register(cls, name, *args, **kw):
+  ret = registry.get(name)
+  if ret is None:
+    ret = registry[name] = cls(name, *args, **kw)
+  return ret
+
+def counter(name, help=''):
+  return _register(Counter, name, help)
+
+def histogram(name, help='', buckets=None):
+  return _register(Histogram, name, help, buckets)
+
+def gauge(name, help, collect, type='gauge'):
+  registry[name] = Gauge(name, help, collect, type)
+  return registry[name]
+
+def render():
+  lines = []
+  for metric in registry.values():
+    lines.append(f"# HELP {metric.name} {metric.help}")
+    lines.append(f"# TYPE {metric.name} {metric.type}")
+    for name, labels, value in metric.samples():
+      lines.append(f"{name}{_labels(labels)} {value}")
+  lines.append('')
+  return '\n'.join(lines)
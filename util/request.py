@@ -1,23 +1,54 @@
+import json as _json, asyncio
+from urllib.parse import urlencode
+
 from util import mixin
+from util.aio import run, SingleFlight
+from util.deadline import remaining
+from util.transport import Transport
+
+from util.view import view
+from requests import Request, Response
+from requests.exceptions import Timeout
+transport = Transport()
+flights = SingleFlight()
+
+def configure(**kw):
+  global transport
+  transport.close()
+  transport = Transport(**kw)
 
-from munch import munchify
-from requests import Request, Session, Response
-_session = Session()
+def _key(self, params, json):
+  dumps = lambda e: _json.dumps(e, sort_keys=True, default=str)
+  return (self.method, self.url, dumps(self.params), dumps(params), dumps(json))
 
 @mixin(Request)
 class _Request:
-  def __call__(self, params=None, json=None):
-    req = self.prepare()
+  def _template(self):
+    ret = self.__dict__.get('_prepared')
+    if ret is None:
+      ret = self._prepared = self.prepare()
+    return ret
+    
+  def __call__(self, params=None, json=None, timeout=None):
+    req = self._template().copy()
     if params:
-      req.prepare_url(req.url, params)
+      query = urlencode([(k, v) for k, v in params.items() if v is not None], doseq=True)
+      req.url = f"{req.url}{'&' if '?' in req.url else '?'}{query}"
     if json:
       req.prepare_body(None, self.files, json)
-    return _session.send(req)
+    try:
+      return transport.send(req, timeout)
+    except Timeout as e:    # surfaces like any other exhausted budget
+      raise asyncio.TimeoutError(str(e)) from e
+  
+  def fetch(self, params=None, json=None):
+    """Awaitable `__call__`; identical requests in flight share a response"""
+    return flights(_key(self, params, json), run, self, params, json, remaining())
     
     
 @mixin(Response)
 class _Reponse:
   def result(self):
     if self.ok:
-      return munchify(self.json())
+      return view(self.json())
   
@@ -0,0 +1,112 @@
+import os, sqlite3, threading
+from math import ceil
+from time import time
+
+try:
+  import redis
+except ImportError:
+  redis = None
+
+
+class Store:
+  """String key-value store; failures read as misses"""
+  def get(self, key):
+    raise NotImplementedError
+
+  def set(self, key, value, ttl=None):
+    raise NotImplementedError
+
+  def delete(self, key):
+    raise NotImplementedError
+
+
+class FileStore(Store):
+  """SQLite file shared by the processes of one host"""
+  def __init__(self, path, purge=1000):
+    self.path = path
+    self._purge = purge
+    self._writes = 0
+    self._local = threading.local()
+
+  @property
+  def _db(self):
+    local = self._local
+    if getattr(local, 'pid', None) != os.getpid():   # connections do not survive a fork
+      db = sqlite3.connect(self.path, timeout=1.0, isolation_level=None, check_same_thread=False)
+      db.execute('PRAGMA journal_mode=WAL')
+      db.execute('PRAGMA synchronous=NORMAL')
+      db.execute('CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT NOT NULL, expiry REAL)')
+      local.db, local.pid = db, os.getpid()
+    return local.db
+
+  def get(self, key):
+    try:
+      row = self._db.execute('SELECT value, expiry FROM kv WHERE key = ?', (key,)).fetchone()
+    except sqlite3.Error:
+      return None
+    if row is None or row[1] is not None and row[1] <= time():
+      return None
+    return row[0]
+
+  def set(self, key, value, ttl=None):
+    expiry = time() + ttl if ttl else None
+    try:
+      db = self._db
+      db.execute('INSERT OR REPLACE INTO kv (key, value, expiry) VALUES (?, ?, ?)', (key, value, expiry))
+      self._writes += 1
+      if self._writes % self._purge == 0:
+        db.execute('DELETE FROM kv WHERE expiry <= ?', (time(),))
+    except sqlite3.Error:
+      pass
+
+  def delete(self, key):
+    try:
+      self._db.execute('DELETE FROM kv WHERE key = ?', (key,))
+    except sqlite3.Error:
+      pass
+
+
+class RedisStore(Store):
+  def __init__(self, url, timeout=0.5):
+    self.url = url
+    self.timeout = timeout
+    self._client = None
+    self._pid = None
+
+  @property
+  def _redis(self):
+    if self._pid != os.getpid():
+      self._client = redis.Redis.from_url(self.url, decode_responses=True,
+                                          socket_timeout=self.timeout, socket_connect_timeout=self.timeout)
+      self._pid = os.getpid()
+    return self._client
+
+  def get(self, key):
+    try:
+      return self._redis.get(key)
+    except redis.RedisError:
+      return None
+
+  def set(self, key, value, ttl=None):
+    try:
+      self._redis.set(key, value, ex=ceil(ttl) if ttl else None)
+    except redis.RedisError:
+      pass
+
+  def delete(self, key):
+    try:
+      self._redis.delete(key)
+    except redis.RedisError:
+      pass
+
+
+def connect(url):
+  if not url or url == 'memory':
+    return None
+  if url.startswith('file:'):
+    return FileStore(url[len('file:'):])
+  if url.startswith(('redis://', 'rediss://', 'unix://')):
+    if redis is None:
+      raise ImportError(f"cache store {url} needs the redis package (pip install redis)")
+    return RedisStore(url)
+  raise ValueError(f"unknown cache store: {url}")
@@ -0,0 +1,58 @@
+import os, signal, time
+import multiprocessing
+
+
+def _serve(target, sockets):
+  os.setpgrp()    # only the supervisor stops workers, so a terminal's Ctrl+C reaches them once
+  target(sockets=sockets)
+
+class Supervisor:
+  """Keeps `workers` processes running; SIGHUP restarts them in turn"""
+  def __init__(self, target, workers, grace=30.0):
+    self.target = target
+    self.workers = workers
+    self.grace = grace
+    self._context = multiprocessing.get_context('spawn')
+    self._processes = []
+    self._restart = False
+    self._exit = False
+    
+  def _spawn(self, sockets):
+    process = self._context.Process(target=_serve, args=(self.target, sockets))
+    process.start()
+    return process
+  
+  def _stop(self, processes):
+    for process in processes:
+      process.terminate()
+    end = time.monotonic() + self.grace
+    for process in processes:
+      process.join(max(end - time.monotonic(), 0))
+      if process.is_alive():
+        process.kill()
+        process.join()
+        
+  def _on_exit(self, sig, frame):
+    self._exit = True
+    
+  def _on_restart(self, sig, frame):
+    self._restart = True
+    
+  def run(self, sockets):
+    signal.signal(signal.SIGINT, self._on_exit)
+    signal.signal(signal.SIGTERM, self._on_exit)
+    signal.signal(signal.SIGHUP, self._on_restart)
+    self._processes = [self._spawn(sockets) for i in range(self.workers)]
+    try:
+      while not self._exit:
+        if self._restart:
+          self._restart = False
+          for i, process in enumerate(self._processes):
+            self._processes[i] = self._spawn(sockets)
+            self._stop([process])
+        for i, process in enumerate(self._processes):
+          if not process.is_alive():
+            self._processes[i] = self._spawn(sockets)
+        time.sleep(0.5)
+    finally:
+      self._stop(self._processes)
@@ -0,0 +1,34 @@
+import re
+
+_space = re.compile(r"\s+")
+_spaces = re.compile(r" {2,}")
+_newline = re.compile(r"\s*[\n\r]+\s*")
+_terminated = re.compile(r"[.!?]$")
+
+
+class Text(str):
+  """Stripped, whitespace-collapsed text with its cache `key`"""
+  def __new__(cls, raw):
+    raw = raw.strip()
+    self = super().__new__(cls, _space.sub(' ', raw))
+    self.key = self.casefold()
+    self.lines = _newline.split(raw) if raw else []
+    return self
+
+def normalize(text):
+  if isinstance(text, Text):
+    return text.key
+  return _space.sub(' ', str(text)).strip().casefold()
+
+def lines(text):
+  return _newline.split(text)
+
+def join(text):
+  return _newline.sub('', text)
+
+def squeeze(text):
+  return _spaces.sub(' ', text)
+
+def sentence(text):
+  text = text.strip()
+  return text if _terminated.search(text) else f"{text}…"
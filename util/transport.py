@@ -0,0 +1,118 @@
+import os, ssl, asyncio, threading
+from time import monotonic
+
+from requests import Session, Response
+from requests.adapters import HTTPAdapter, BaseAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import DEFAULT_CA_BUNDLE_PATH, select_proxy
+
+try:
+  import httpx
+  import h2   # httpx negotiates HTTP/2 only with it
+except ImportError:
+  httpx = None
+
+
+def _ssl_context(verify, cert):
+  if verify is False:
+    ret = ssl.create_default_context()
+    ret.check_hostname = False
+    ret.verify_mode = ssl.CERT_NONE
+  else:
+    path = DEFAULT_CA_BUNDLE_PATH if verify is True else verify
+    ret = ssl.create_default_context(**({ 'capath': path } if os.path.isdir(path) else { 'cafile': path }))
+  if cert:
+    ret.load_cert_chain(*((cert,) if isinstance(cert, str) else cert))
+  return ret
+
+
+class KeepAliveAdapter(HTTPAdapter):
+  """Closes pooled connections idle for over `keepalive` seconds"""
+  def __init__(self, keepalive=5.0, **kw):
+    self.keepalive = keepalive
+    self._used = monotonic()
+    super().__init__(**kw)
+
+  def send(self, request, *args, **kw):
+    if self.keepalive and monotonic() - self._used > self.keepalive:
+      self.poolmanager.clear()
+    self._used = monotonic()
+    try:
+      return super().send(request, *args, **kw)
+    finally:
+      self._used = monotonic()
+
+
+class HTTP2Adapter(BaseAdapter):
+  """Sends requests over `httpx`, answering `requests` responses"""
+  def __init__(self, pool_size=10, keepalive=5.0, retries=0):
+    super().__init__()
+    self._limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size,
+                                keepalive_expiry=keepalive)
+    self._retries = retries
+    self._clients = {}    # (verify, cert, proxy) -> httpx.Client
+    self._lock = threading.Lock()
+
+  def _client(self, verify, cert, proxy):
+    key = (verify, cert, proxy)
+    with self._lock:
+      ret = self._clients.get(key)
+      if ret is None:
+        transport = httpx.HTTPTransport(http2=True, verify=_ssl_context(verify, cert), limits=self._limits,
+                                        retries=self._retries, proxy=proxy and httpx.Proxy(proxy))
+        ret = self._clients[key] = httpx.Client(transport=transport)
+      return ret
+
+  def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+    if isinstance(cert, list):
+      cert = tuple(cert)
+    client = self._client(verify, cert, select_proxy(request.url, proxies or {}))
+    res = client.request(request.method, request.url, headers=dict(request.headers),
+                         content=request.body, timeout=timeout)
+    ret = Response()
+    ret.status_code = res.status_code
+    ret.headers = CaseInsensitiveDict(res.headers)
+    ret._content = res.content
+    ret.encoding = res.encoding
+    ret.reason = res.reason_phrase
+    ret.url = request.url
+    ret.request = request
+    return ret
+
+  def close(self):
+    with self._lock:
+      for client in self._clients.values():
+        client.close()
+      self._clients.clear()
+
+
+class Transport:
+  """Shared, pooled HTTP session"""
+  def __init__(self, pool_size=10, hosts=None, retries=0, http2=False, keepalive=5.0, timeout=None):
+    self.session = Session()
+    self.timeout = timeout
+    self.retries = retries
+    self.http2 = bool(http2 and httpx)
+    self.keepalive = keepalive
+    self.mount('https://', pool_size)
+    self.mount('http://', pool_size)
+    for host, size in (hosts or {}).items():
+      self.mount(f"https://{host}/", size)
+
+  def _adapter(self, pool_size):
+    if self.http2:
+      return HTTP2Adapter(pool_size, self.keepalive, self.retries)
+    return KeepAliveAdapter(self.keepalive, pool_maxsize=pool_size, max_retries=self.retries)
+
+  def mount(self, prefix, pool_size):
+    self.session.mount(prefix, self._adapter(pool_size))
+
+  def send(self, request, timeout=None, **kw):
+    if timeout is None:
+      timeout = self.timeout
+    elif timeout <= 0:    # the deadline is spent already
+      raise asyncio.TimeoutError(request.url)
+    return self.session.send(request, timeout=timeout, **kw)
+
+  def close(self):
+    self.session.close()
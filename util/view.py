@@ -0,0 +1,55 @@
+from collections.abc import Mapping, Sequence
+
+
+class View(Mapping):
+  __slots__ = ('_data',)
+  def __init__(self, data):
+    self._data = data
+    
+  def __getattr__(self, name):
+    try:
+      return view(self._data[name])
+    except KeyError:
+      raise AttributeError(name) from None
+    
+  def __getitem__(self, key):
+    return view(self._data[key])
+  
+  def __contains__(self, key):
+    return key in self._data
+    
+  def __iter__(self):
+    return iter(self._data)
+  
+  def __len__(self):
+    return len(self._data)
+  
+  def __repr__(self):
+    return f"View({self._data!r})"
+
+class ListView(Sequence):
+  __slots__ = ('_data',)
+  def __init__(self, data):
+    self._data = data
+    
+  def __getitem__(self, index):
+    return view(self._data[index])
+  
+  def __iter__(self):
+    return map(view, self._data)
+  
+  def __len__(self):
+    return len(self._data)
+  
+  def __repr__(self):
+    return f"ListView({self._data!r})"
+
+def view(data):
+  if isinstance(data, dict):
+    return View(data)
+  if isinstance(data, list):
+    return ListView(data)
+  return data
+
+def unwrap(data):
+  return data._data if isinstance(data, (View, ListView)) else data
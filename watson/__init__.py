@@ -1,8 +1,8 @@
-from munch import munchify
+from util.view import view
 
 
 class Result:
   def __new__(cls, res):
-    return munchify(res.get_result())
+    return view(res.get_result())
 
 from .assistant import Assistant
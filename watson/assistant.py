@@ -2,67 +2,130 @@ from itertools import chain, repeat
 from collections import namedtuple, defaultdict
 from uuid import uuid4
 from datetime import datetime
-import re
+from time import time
+import re, json
 
-from ibm_watson import AssistantV2, AssistantV1
+from ibm_watson import AssistantV2, AssistantV1, ApiException
 from ibm_watson.assistant_v2 import MessageInput, MessageInputOptions, RuntimeIntent
 from ibm_watson.assistant_v1 import \
   MessageInput as MessageInput_1, RuntimeIntent as RuntimeIntent_1, \
   Example, DialogNodeOutput, DialogNodeOutputGeneric, DialogNodeOutputTextValuesElement as DialogNodeText
 from munch import munchify
 
-from util import Timer, Data, String, split, Object
+from util import Timer, Data, String, Object, lines, normalize
+from util.aio import run, WriteBehind, SingleFlight
+from util.deadline import spend, detach
+from util.breaker import CircuitBreaker, CircuitOpen
 from watson import Result
+from util.view import unwrap
+from watson.session import SessionPool
 
 def uuid():
   return uuid4().hex
 
+flights = SingleFlight()
+
+def _dumps(data):
+  return json.dumps(data, sort_keys=True, default=str)
+
 _Output = namedtuple('Output', 'text intent confidence')
 
 Fallback = namedtuple('Fallback', 'assistant threshold')
 
+class State:
+  def __init__(self):
+    self.context = None
+    self.session = None
+    self.timer = Timer(mins=4)   # sessions expire after 5 minutes of inactivity
+    
+  def dump(self):
+    return { 'context': self.context, 'session': self.session, 'started': self.timer.started }
+  
+  @classmethod
+  def load(cls, data):
+    ret = cls()
+    ret.context = data.get('context')
+    ret.session = data.get('session')
+    if data.get('started') is not None:
+      ret.timer(data['started'])
+    return ret
+
 class Assistant:
   _api = AssistantV2
   api_version = 2
+  stage = 'watson'
   @classmethod
   def v1(cls, id, **kw):
     return V1(id, **kw)
   
-  def __init__(self, id, **kw):
+  def __init__(self, id, sessions=8, timeout=None, **kw):
     self._id = id
     self._service = self._api(**kw)
-    self._session = None
-    self._timer = Timer(mins=5)
+    if timeout:
+      self._service.set_http_config({ 'timeout': timeout })
+    self.sessions = SessionPool(self._create_session, sessions)
+    self.breaker = CircuitBreaker(self.stage)
     self.return_context = True
     self.version = self._service.version
-    self.context = None
+    self._state = {}    # used by callers without a conversation of their own
     self._fallback = None
     
-  @property
-  def session_id(self):
-    if not self._session or self._timer: # expired
-      self._session = self._service.create_session(self._id).get_result()['session_id']
-      self._timer()   # restart timer
-    return self._session
+  def state(self, store=None):
+    if store is None:
+      store = self._state
+    ret = store.get(self._id)
+    if ret is None:
+      ret = store[self._id] = State()
+    return ret
+    
+  def _create_session(self):
+    return self._service.create_session(self._id).get_result()['session_id']
+    
+  async def _new_session(self):
+    with spend(self.stage):
+      return await self.breaker(self.sessions.create)
+    
+  async def session_id(self, state):
+    if not state.session or state.timer: # expired
+      state.session = self.sessions.acquire() or await self._new_session()
+    state.timer()   # restart timer
+    return state.session
   
-  def _output(self, output, text, intents):
+  async def _output(self, output, text, intents, state):
     fallback = self._fallback
     if not output:
       return output
     if fallback and output.confidence < fallback.threshold or not output.intent:
-      return fallback.assistant(text, intents)
+      try:
+        return await fallback.assistant(text, intents, state)
+      except CircuitOpen:   # degrade to our own output
+        pass
     return output
     
-  def __call__(self, text=None, intents=None, bypass=False):
+  def _message(self, input, state):
+    return self._service.message(self._id, state.session, input, state.context)
+    
+  def _key(self, input, state):
+    return (self._id, state.session, _dumps(input), _dumps(state.context))
+    
+  async def _send(self, input, state):
+    """Identical messages in flight share their result"""
+    key = self._key(input, state)
+    with spend(self.stage):
+      return await self.breaker(flights, key, run, self._message, input, state)
+    
+  async def __call__(self, text=None, intents=None, bypass=False, state=None):
     if intents:
       intents = [RuntimeIntent(e, 1) for e in intents]
     options = MessageInputOptions(return_context=self.return_context)
     input = MessageInput(text=text, intents=intents, options=options)._to_dict()
     
-    res = Result(self._service.message(self._id, self.session_id, input, self.context))
-    self.context = res.get('context')
+    _state = self.state(state)
+    await self.session_id(_state)
+    res = Result(await self._send(input, _state))
+    _state.context = unwrap(res).get('context')
     ret = Output(res.output)
-    return ret if bypass else self._output(ret, text, intents)
+    return ret if bypass else await self._output(ret, text, intents, state)
   
   def __setitem__(self, input, output):
     raise NotImplementedError
@@ -93,25 +156,137 @@ class DialogNode:
     name = intent.intent
     return Object(dialog_node=name, description=intent.description, conditions=f'#{name}', output=output)
     
+class Answers:
+  """Learned answers, by exact and normalized question"""
+  def __init__(self, store=None, backlog=1000):
+    self._exact = {}
+    self._normal = {}
+    self._store = store
+    self.writes = WriteBehind(self._write, backlog) if store else None
+    
+  def __len__(self):
+    return len(self._normal)
+  
+  def index(self, question, answer):
+    self._exact[question] = answer
+    self._normal[normalize(question)] = answer
+  
+  def __setitem__(self, question, answer):
+    self.index(question, answer)
+    if self.writes is not None:
+      self.writes.put(f"answers:{normalize(question)}", json.dumps(answer))
+      
+  def _write(self, key, raw):
+    return run(self._store.set, key, raw)
+    
+  def get(self, question, default=None):
+    ret = self._exact.get(question)
+    if ret is None:
+      ret = self._normal.get(normalize(question))
+    return default if ret is None else ret
+  
+  async def fetch(self, question, default=None):
+    """Like `get`, also looking in the shared store"""
+    ret = self.get(question)
+    if ret is None and self._store:
+      key = normalize(question)
+      raw = await run(self._store.get, f"answers:{key}")
+      if raw is not None:
+        ret = self._normal[key] = tuple(json.loads(raw))
+    return default if ret is None else ret
+  
 class V1(Assistant):
   _api = AssistantV1
   api_version = 1
-  def __call__(self, text, intents=None):
+  stage = 'wikibot'
+  def __init__(self, id, backlog=1000, store=None, journal=None, **kw):
+    super().__init__(id, sessions=0, **kw)   # v1 is sessionless
+    self.writes = WriteBehind(self._write, backlog)
+    self.answers = Answers(store, backlog)
+    self.loaded = False   # set once the workspace's answers are indexed
+    self.journal = journal    # `util.cache.Journal` of what was learned, keyed by normalized question
+    self._created = set()     # intents stored whose dialog node is still to be
+    
+  def _load(self):
+    intents = self._service.list_intents(self._id, export=True, page_limit=10000).get_result()['intents']
+    nodes = self._service.list_dialog_nodes(self._id, page_limit=10000).get_result()['dialog_nodes']
+    answers = {}
+    for node in nodes:
+      name = (node.get('conditions') or '').lstrip('#')
+      generic = (node.get('output') or {}).get('generic') or [{}]
+      values = generic[0].get('values') or [{}]
+      if values[0].get('text'):
+        answers[name] = values[0]['text']
+    for intent in intents:
+      text = answers.get(intent['intent'])
+      if text:
+        for example in intent.get('examples', []):
+          self.answers.index(example['text'], (intent['intent'], text))
+    
+  def _load_journal(self):
+    pairs = self.journal.load()
+    for key, e in pairs:
+      self.answers.index(e['question'], (e['intent'], e['answer']))
+    return len(pairs)
+    
+  async def load(self):
+    if self.journal:
+      if await run(self._load_journal) > len(self.answers):
+        detach(run(self.journal.compact))
+    await run(self._load)
+    self.loaded = True
+    
+  def _message(self, input, state):
+    return self._service.message(self._id, input, alternate_intents=False)
+    
+  def _key(self, input, state):
+    return (self._id, _dumps(input))
+    
+  async def __call__(self, text, intents=None, state=None):
+    """Stateless, so identical questions can share a message"""
+    answer = await self.answers.fetch(text) if text else None
+    if answer is not None:
+      return Answer(*answer)
+    
     input = MessageInput_1(text=text)._to_dict()
-    res = Result(self._service.message(self._id, input, alternate_intents=False, context=self.context))
-    self.context = res.get('context')
-    return self._output(Output_1(res), text, intents)
+    res = Result(await self._send(input, self.state(state)))
+    return await self._output(Output_1(res), text, intents, state)
   
   def __setitem__(self, input, output):
     description = None
     if not isinstance(input, str):
       input, description = input
       
-    intent = Intent(input, description)
-    self._service.create_intent(self._id, **intent)
+    try:
+      intent = Intent(input, description)
+      node = DialogNode(intent, output)
+    except AssertionError:  # not storable as an intent/dialog node
+      return
+    key = normalize(input)
+    self.answers[input] = (intent.intent, output.strip())
+    self.writes.put(key, (intent, node))
+    if self.journal:
+      self.journal.put(key, { 'intent': intent.intent, 'question': input, 'caption': description,
+                              'answer': output.strip(), 'time': time() })
+    
+  def _write(self, key, value):
+    return run(self._store, *value)
     
-    node = DialogNode(intent, output)
-    self._service.create_dialog_node(self._id, **node)
+  def _store(self, intent, node):
+    """Idempotent on retry: a 409 conflict counts as done"""
+    name = intent.intent
+    if name not in self._created:
+      self._create(self._service.create_intent, **intent)
+      self._created.add(name)
+    self._create(self._service.create_dialog_node, **node)
+    self._created.discard(name)
+    
+  def _create(self, create, **kw):
+    try:
+      create(self._id, **kw)
+    except ApiException as e:
+      if e.code != 409:   # conflict: already exists
+        raise
 
 _entities = ({},)
 _intents = repeat(RuntimeIntent(None, 1))
@@ -139,7 +314,7 @@ class Output(Data):
   
   @property
   def text(self):
-    return split(self._text) if self else []
+    return lines(self._text) if self else []
   
   @property
   def intent(self):
@@ -153,6 +328,13 @@ class Output(Data):
   def data(self):
     return self._source
 
+class Answer(Output):
+  def __init__(self, intent, text):
+    Data.__init__(self)
+    self._source = None
+    self._entities = defaultdict(dict)
+    self._append(_Output(text, intent, 1.0))
+
 _intents_1 = repeat(RuntimeIntent_1(None, 1))
 class Output_1(Output):
   def __init__(self, data):
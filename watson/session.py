@@ -0,0 +1,79 @@
+import asyncio, logging
+from collections import deque
+from time import monotonic
+
+from util.aio import run
+from util.deadline import detach
+
+_logger = logging.getLogger(__name__)
+
+
+class SessionPool:
+  """Pre-created Watson (v2) sessions, renewed before they expire"""
+  def __init__(self, create, size=8, lifetime=300, margin=60):
+    self._create = create
+    self._idle = deque()    # (session id, creation time), oldest first
+    self._filling = None
+    self._renewal = None
+    self.size = size
+    self.lifetime = lifetime
+    self.margin = margin
+    self.created = 0
+    self.renewed = 0
+    self.failed = 0
+    self.acquired = 0
+    self.misses = 0
+    
+  def __len__(self):
+    return len(self._idle)
+  
+  def _stale(self, created):
+    return monotonic() - created >= self.lifetime - self.margin
+  
+  async def create(self):
+    try:
+      ret = await run(self._create)
+    except Exception:
+      self.failed += 1
+      _logger.exception('Failed to create a session')
+      raise
+    self.created += 1
+    return ret
+    
+  async def _fill(self):
+    while len(self._idle) < self.size:
+      try:
+        self._idle.append((await self.create(), monotonic()))
+      except Exception:
+        return
+      
+  def fill(self):
+    if self.size and (self._filling is None or self._filling.done()):
+      self._filling = detach(self._fill())
+    
+  def acquire(self):
+    """A pooled session id, or None if the pool ran dry"""
+    self.acquired += 1
+    while self._idle:
+      id, created = self._idle.popleft()
+      if not self._stale(created):
+        self.fill()
+        return id
+    self.misses += 1
+    self.fill()
+    return None
+  
+  async def _renew(self):
+    while True:
+      await asyncio.sleep(max(self.margin / 2, 1))
+      stale = 0
+      while self._idle and self._stale(self._idle[0][1]):
+        self._idle.popleft()
+        stale += 1
+      self.renewed += stale
+      self.fill()
+      
+  def start(self):
+    if self.size and self._renewal is None:
+      self.fill()
+      self._renewal = detach(self._renew())